@@ -179,6 +179,78 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50 MB
 AUDIO_FILE_EXTENSIONS = ['.mp3', '.wav', '.ogg', '.m4a', '.aac', '.flac']
 MAX_AUDIO_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 
+# Настройки рекомендательной системы
+# Время жизни матриц, которые движок рекомендаций держит в памяти процесса (в секундах)
+RECOMMENDATION_MATRIX_TTL = 300
+# Период, с которым рейтинг популярности перечитывается из базы целиком (в секундах)
+RECOMMENDATION_LEADERBOARD_TTL = 3600
+# Время хранения готового списка рекомендаций пользователя в кэше (в секундах).
+# Актуальность записей проверяется по базе; чтобы изменение предпочтений и
+# защита от повторного фонового пересчета действовали во всех процессах,
+# нужен общий бэкенд кэша (CACHES, например Redis или Memcached)
+RECOMMENDATION_CACHE_TIMEOUT = 900
+# Режим выдачи рекомендаций в for_you:
+# 'sync' - рассчитывать при запросе,
+# 'stale_while_revalidate' - отдавать сохраненные и пересчитывать устаревшие в фоне
+RECOMMENDATION_SERVING_MODE = 'sync'
+# Возраст сохраненных рекомендаций, после которого они пересчитываются (в секундах)
+RECOMMENDATION_STALE_AFTER = 3600
+# Количество фоновых процессов для пересчета рекомендаций
+RECOMMENDATION_REFRESH_WORKERS = 1
+# Отложенная запись показов рекомендаций пакетами
+RECOMMENDATION_IMPRESSION_BUFFER = False
+RECOMMENDATION_IMPRESSION_BATCH_SIZE = 500
+# Максимальное время хранения показов в буфере (в секундах)
+RECOMMENDATION_IMPRESSION_FLUSH_INTERVAL = 5
+# Каталог для файлов движка рекомендаций (модели, матрицы)
+RECOMMENDATION_DATA_DIR = os.path.join(BASE_DIR, 'recommendation_data')
+# Источник коллаборативных рекомендаций:
+# 'similarity' - сходство пользователей (таблица UserSimilarity),
+# 'als' - матричная факторизация неявной обратной связи
+RECOMMENDATION_COLLABORATIVE_BACKEND = 'similarity'
+# Количество похожих пользователей, которые сохраняются для каждого пользователя
+# (None - сохранять все пары с положительным сходством)
+RECOMMENDATION_SIMILARITY_NEIGHBOURS = 50
+# Количество похожих треков (коллаборативное сходство), которые сохраняются для каждого трека
+# (None - сохранять все пары с положительным сходством)
+RECOMMENDATION_TRACK_SIMILARITY_NEIGHBOURS = None
+# Максимальный объем памяти под блок матрицы сходства при ее расчете (в байтах)
+RECOMMENDATION_SIMILARITY_BLOCK_MEMORY = 256 * 1024 * 1024
+# Количество пар сходства в одном запросе вставки
+RECOMMENDATION_SIMILARITY_INSERT_BATCH = 10000
+# Способ расчета сходства пользователей при полном пересчете:
+# 'exact' - все пары, 'lsh' - только пары-кандидаты по сигнатурам случайных гиперплоскостей.
+# Замер scripts/benchmark_lsh_similarity.py (20 полос, 50 соседей, 30 взаимодействий
+# у пользователя): при 5000 пользователей точный расчет занимает 0.5 с, LSH с 8/6/4
+# битами в полосе - 0.3/0.5/1.3 с при полноте 0.13/0.37/0.80; при 30000 пользователей
+# точный - 12 с, LSH - 7/17/30 с при полноте 0.21/0.51/0.49. На разреженных
+# взаимодействиях LSH быстрее точного расчета только при низкой полноте, поэтому
+# по умолчанию используется 'exact'
+RECOMMENDATION_USER_SIMILARITY_METHOD = 'exact'
+# Количество полос сигнатуры и бит в полосе: больше полос и меньше бит - выше полнота
+# и больше пар-кандидатов (дольше расчет)
+RECOMMENDATION_LSH_BANDS = 20
+RECOMMENDATION_LSH_ROWS_PER_BAND = 8
+# Максимальный размер корзины LSH (большие корзины делятся на части)
+RECOMMENDATION_LSH_MAX_BUCKET = 1000
+# Размерность скрытого пространства (усеченное SVD), в котором считается сходство
+# пользователей и треков (None - сходство по исходным разреженным векторам)
+RECOMMENDATION_SIMILARITY_SVD_COMPONENTS = None
+# Веса коллаборативного и контентного сходства в гибридном сходстве треков
+RECOMMENDATION_HYBRID_COLLABORATIVE_WEIGHT = 0.5
+RECOMMENDATION_HYBRID_CONTENT_WEIGHT = 0.5
+# Количество похожих треков (гибридное сходство), которые сохраняются для каждого трека
+RECOMMENDATION_HYBRID_NEIGHBOURS = 20
+# Хранилище сходства: 'database' (таблицы UserSimilarity и TrackSimilarity)
+# или 'packed' (упакованные списки соседей в RECOMMENDATION_DATA_DIR)
+RECOMMENDATION_SIMILARITY_STORAGE = 'database'
+# Параметры обучения матричной факторизации (ALS)
+RECOMMENDATION_ALS_FACTORS = 32
+RECOMMENDATION_ALS_ITERATIONS = 15
+RECOMMENDATION_ALS_REGULARIZATION = 0.1
+# Множитель уверенности для весов взаимодействий
+RECOMMENDATION_ALS_ALPHA = 40.0
+
 # Настройки безопасности для файлов
 SECURE_CROSS_ORIGIN_OPENER_POLICY = None  # Разрешаем cross-origin для аудио
 X_FRAME_OPTIONS = 'SAMEORIGIN'
@@ -15,14 +15,14 @@ class UserTrackRecommendationAdmin(admin.ModelAdmin):
 
 @admin.register(UserSimilarity)
 class UserSimilarityAdmin(admin.ModelAdmin):
-    list_display = ('user_a', 'user_b', 'similarity_score', 'last_updated')
+    list_display = ('user_a', 'user_b', 'similarity_score', 'generation', 'last_updated')
     list_filter = ('last_updated',)
     search_fields = ('user_a__username', 'user_b__username')
 
 
 @admin.register(TrackSimilarity)
 class TrackSimilarityAdmin(admin.ModelAdmin):
-    list_display = ('track_a', 'track_b', 'similarity_score', 'similarity_type', 'last_updated')
+    list_display = ('track_a', 'track_b', 'similarity_score', 'similarity_type', 'generation', 'last_updated')
     list_filter = ('similarity_type', 'last_updated')
     search_fields = ('track_a__title', 'track_b__title')
 
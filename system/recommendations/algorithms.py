@@ -1,18 +1,458 @@
 # recommendations/algorithms.py
 
+import functools
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import as_completed
+
 import numpy as np
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from collections import defaultdict
+from scipy import sparse
+from sklearn.preprocessing import normalize
 
-from django.db import connection
+from django.db import connection, transaction
 from django.db.models import Count, Avg, Q, F
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 from users.models import User
-from tracks.models import Track, UserTrackInteraction, Genre
-from .models import UserTrackRecommendation, UserSimilarity, TrackSimilarity, UserPreference
+from tracks.models import Track, UserTrackInteraction
+from .models import UserTrackRecommendation, UserPreference, SimilarityWatermark
+from .audio_features import audio_feature_store
+from .cache import recommendation_cache
+from .impressions import impression_buffer, mark_recommendations_shown
+from .instrumentation import instrumentation
+from .lsh import bucket_matrix, candidate_matrix, hyperplane_signatures
+from .matrices import (
+    FactorMatrixData, InteractionMatrixData, TrackGenreMatrixData,
+    factor_matrix, interaction_matrix, track_genre_matrix
+)
+from .popularity import popularity_leaderboard
+from .profiles import UserProfileSnapshot
+from .projections import project_rows
+from .similarity_storage import track_similarity_storage, user_similarity_storage
+from .worker import create_process_pool, run_batch_shard
+
+
+def _empty_recommendations():
+    """
+    Пустой результат источника рекомендаций: массивы ID треков и оценок
+    """
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+
+def _top_k(scores, limit, tiebreak=None):
+    """
+    Индексы limit наибольших оценок в порядке убывания.
+    
+    Кандидаты отбираются частичной сортировкой (np.argpartition), полностью
+    сортируются только выбранные. При равных оценках меньшее значение tiebreak
+    идет первым (по умолчанию - меньший индекс)
+    """
+    if limit <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+    
+    if len(scores) > limit:
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        # Оценки, равные limit-й, могли попасть в выборку не все: берем их все,
+        # чтобы порядок tiebreak выбирал из полного набора равных
+        top = np.flatnonzero(scores >= scores[top].min())
+    else:
+        top = np.arange(len(scores))
+    
+    secondary = top if tiebreak is None else tiebreak[top]
+    return top[np.lexsort((secondary, -scores[top]))][:limit]
+
+
+def _top_k_rows(scores, limit, tiebreak=None):
+    """
+    Построчный вариант _top_k для двумерной матрицы оценок.
+    Возвращает индексы столбцов (строки x limit) в порядке убывания оценок в каждой строке
+    """
+    n_rows, n_cols = scores.shape
+    k = min(limit, n_cols)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.intp)
+    
+    if n_cols > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(n_cols), (n_rows, 1))
+    
+    values = np.take_along_axis(scores, top, axis=1)
+    secondary = top if tiebreak is None else tiebreak[top]
+    row_numbers = np.repeat(np.arange(n_rows), k)
+    order = np.lexsort((secondary.ravel(), -values.ravel(), row_numbers))
+    top = top.ravel()[order].reshape(n_rows, k)
+    
+    if n_cols > k:
+        # Строки, где равные k-й оценки не поместились в выборку, пересчитываем
+        # по полному набору равных (как в _top_k)
+        ties = np.flatnonzero((scores >= values.min(axis=1)[:, None]).sum(axis=1) > k)
+        for row in ties:
+            top[row] = _top_k(scores[row], k, tiebreak)
+    
+    return top
+
+
+def _select_pairs(block, k=None, threshold=0.0):
+    """
+    Выбрать из блока матрицы сходства пары со сходством больше threshold.
+    
+    Если k задано, в каждой строке остается не более k пар с наибольшим сходством,
+    отбор выполняется частичной сортировкой (np.argpartition).
+    Возвращает массивы (номера строк, номера столбцов, сходство)
+    """
+    if k and k < block.shape[1]:
+        columns = np.argpartition(-block, k - 1, axis=1)[:, :k].ravel()
+        rows = np.repeat(np.arange(block.shape[0]), k)
+    else:
+        rows, columns = np.nonzero(block > threshold)
+    
+    scores = block[rows, columns]
+    keep = scores > threshold
+    return rows[keep], columns[keep], scores[keep]
+
+
+def _normalize_rows(matrix):
+    """
+    L2-нормализованные строки матрицы (разреженной или плотной) и транспонированная матрица
+    """
+    if sparse.issparse(matrix):
+        normalized = normalize(sparse.csr_matrix(matrix, dtype=np.float64), norm='l2', axis=1)
+        return normalized, normalized.T.tocsc()
+    
+    normalized = normalize(np.asarray(matrix, dtype=np.float64), norm='l2', axis=1)
+    return normalized, normalized.T
+
+
+def _row_blocks(row_indices, n_columns):
+    """
+    Разбить номера строк на блоки так, чтобы плотный блок сходства с n_columns
+    столбцами занимал не больше RECOMMENDATION_SIMILARITY_BLOCK_MEMORY байт
+    """
+    memory = getattr(settings, 'RECOMMENDATION_SIMILARITY_BLOCK_MEMORY', 256 * 1024 * 1024)
+    block_size = max(1, memory // (8 * max(n_columns, 1)))
+    
+    for start in range(0, len(row_indices), block_size):
+        yield row_indices[start:start + block_size]
+
+
+def _cosine_block(normalized, normalized_t, block_rows):
+    """
+    Плотный блок косинусного сходства строк block_rows со всеми строками
+    """
+    block = normalized[block_rows].dot(normalized_t)
+    if sparse.issparse(block):
+        block = block.toarray()
+    return block
+
+
+def _cosine_similarity_pairs(matrix, k=None, threshold=0.0, rows=None):
+    """
+    Косинусное сходство строк разреженной матрицы, рассчитанное блоками.
+    
+    Строки нормализуются один раз, затем каждый блок строк умножается на всю
+    матрицу, и из результата сразу выбираются пары (см. _select_pairs). Размер
+    блока подбирается так, чтобы плотный блок сходства занимал не больше
+    RECOMMENDATION_SIMILARITY_BLOCK_MEMORY байт, поэтому пиковая память не
+    зависит от квадрата количества строк. Сходство строки с самой собой не учитывается.
+    
+    matrix может быть и плотной (например, строки в скрытом пространстве, см. projections.py).
+    rows - номера строк, для которых нужно рассчитать сходство (по умолчанию все).
+    Возвращает генератор массивов (номера строк, номера столбцов, сходство) для каждого блока
+    """
+    normalized, normalized_t = _normalize_rows(matrix)
+    n_rows = normalized.shape[0]
+    row_indices = np.arange(n_rows) if rows is None else np.asarray(rows, dtype=np.intp)
+    
+    for block_rows in _row_blocks(row_indices, n_rows):
+        block = _cosine_block(normalized, normalized_t, block_rows)
+        
+        # Исключаем сходство строки с самой собой
+        block[np.arange(len(block_rows)), block_rows] = 0.0
+        
+        pair_rows, columns, scores = _select_pairs(block, k, threshold)
+        yield block_rows[pair_rows], columns, scores
+
+
+def _approximate_cosine_similarity_pairs(matrix, k=None, threshold=0.0):
+    """
+    Приближенное косинусное сходство строк разреженной матрицы (LSH).
+    
+    Кандидаты в соседи выбираются по совпадению полос сигнатур случайных
+    гиперплоскостей (см. lsh.py), точное сходство считается только для пар
+    кандидатов. Строки обрабатываются блоками, как и в _cosine_similarity_pairs:
+    кандидаты блока собираются без повторов, а разреженный блок сходства
+    маскируется ими, поэтому память ограничена одним блоком. Параметры полос
+    задаются настройками RECOMMENDATION_LSH_BANDS, RECOMMENDATION_LSH_ROWS_PER_BAND
+    и RECOMMENDATION_LSH_MAX_BUCKET (полнота и время в зависимости от них -
+    scripts/benchmark_lsh_similarity.py).
+    Возвращает генератор массивов (номера строк, номера столбцов, сходство),
+    как и _cosine_similarity_pairs
+    """
+    bands = getattr(settings, 'RECOMMENDATION_LSH_BANDS', 20)
+    rows_per_band = getattr(settings, 'RECOMMENDATION_LSH_ROWS_PER_BAND', 8)
+    max_bucket = getattr(settings, 'RECOMMENDATION_LSH_MAX_BUCKET', 1000)
+    
+    normalized, normalized_t = _normalize_rows(sparse.csr_matrix(matrix))
+    normalized_t = normalized_t.tocsr()
+    n_rows = normalized.shape[0]
+    buckets = bucket_matrix(hyperplane_signatures(normalized, bands * rows_per_band), bands, rows_per_band, max_bucket)
+    buckets_t = buckets.T.tocsr()
+    
+    for block_rows in _row_blocks(np.arange(n_rows), n_rows):
+        # Сходство блока остается разреженным и берется только для кандидатов
+        candidates = candidate_matrix(buckets, buckets_t, block_rows)
+        block = normalized[block_rows].dot(normalized_t).multiply(candidates).tocoo()
+        
+        # Исключаем сходство строки с самой собой
+        keep = (block.data > threshold) & (block_rows[block.row] != block.col)
+        rows, columns, scores = _top_k_per_row(block.row[keep], block.col[keep], block.data[keep], k)
+        yield block_rows[rows], columns, scores
+
+
+def _similarity_blocks(matrices, rows=None, extra_blocks=0):
+    """
+    Косинусное сходство строк нескольких матриц признаков одних и тех же
+    объектов, рассчитанное блоками в одном проходе.
+    
+    Для каждого блока строк возвращается список плотных блоков сходства (по
+    одному на матрицу), сходство строки с самой собой обнулено. extra_blocks -
+    количество дополнительных блоков того же размера, которые вызывающий код
+    держит в памяти (учитывается при выборе размера блока).
+    rows - номера строк, для которых нужно рассчитать сходство (по умолчанию все).
+    Возвращает генератор (номера строк блока, список блоков сходства)
+    """
+    normalized = [_normalize_rows(matrix) for matrix in matrices]
+    n_rows = normalized[0][0].shape[0]
+    row_indices = np.arange(n_rows) if rows is None else np.asarray(rows, dtype=np.intp)
+    
+    for block_rows in _row_blocks(row_indices, (len(matrices) + extra_blocks) * n_rows):
+        blocks = []
+        for rows_matrix, columns_matrix in normalized:
+            block = _cosine_block(rows_matrix, columns_matrix, block_rows)
+            block[np.arange(len(block_rows)), block_rows] = 0.0
+            blocks.append(block)
+        yield block_rows, blocks
+
+
+def _blend_blocks(blocks, weights, block_rows, mask=None):
+    """
+    Взвешенная сумма блоков сходства. Сходство в скрытом пространстве может
+    быть отрицательным, оно учитывается как нулевое. mask - маска объектов,
+    участвующих в смешанном сходстве (для остальных сходство нулевое)
+    """
+    blended = np.zeros(blocks[0].shape)
+    for block, weight in zip(blocks, weights):
+        blended += weight * np.maximum(block, 0.0)
+    
+    if mask is not None:
+        blended[:, ~mask] = 0.0
+        blended[~mask[block_rows]] = 0.0
+    return blended
+
+
+def _hybrid_similarity_pairs(matrices, weights, k=None, threshold=0.0, rows=None, mask=None):
+    """
+    Взвешенная сумма косинусного сходства строк нескольких матриц признаков
+    одних и тех же объектов (см. _similarity_blocks и _blend_blocks).
+    Возвращает генератор массивов (номера строк, номера столбцов, сходство),
+    как и _cosine_similarity_pairs
+    """
+    for block_rows, blocks in _similarity_blocks(matrices, rows, extra_blocks=1):
+        pair_rows, columns, scores = _select_pairs(_blend_blocks(blocks, weights, block_rows, mask), k, threshold)
+        yield block_rows[pair_rows], columns, scores
+
+
+def _similarity_features(name, matrix, column_ids, refit=True):
+    """
+    Признаки строк для расчета сходства: исходная разреженная матрица или,
+    если задана настройка RECOMMENDATION_SIMILARITY_SVD_COMPONENTS,
+    ее проекция в скрытое пространство (см. projections.py)
+    """
+    if not getattr(settings, 'RECOMMENDATION_SIMILARITY_SVD_COMPONENTS', None):
+        return matrix
+    return project_rows(name, matrix, column_ids, refit=refit)
+
+
+def _write_similarity_pairs(storage, pairs, ids):
+    """
+    Передать пары сходства (номера строк, номера столбцов, сходство) в хранилище,
+    заменив номера строк на ID объектов. Возвращает количество записанных пар
+    """
+    return _write_similarity_outputs([storage], ([block_pairs] for block_pairs in pairs), ids)
+
+
+def _write_similarity_outputs(storages, blocks, ids):
+    """
+    Вариант _write_similarity_pairs для нескольких хранилищ, заполняемых в одном
+    проходе: каждый элемент blocks - список пар блока для каждого хранилища
+    """
+    written = 0
+    with instrumentation.phase('similarity') as phase:
+        for block_pairs in blocks:
+            with instrumentation.phase('write') as write:
+                for storage, (rows, columns, scores) in zip(storages, block_pairs):
+                    storage.write(ids[rows], ids[columns], scores)
+                    write.rows += len(scores)
+                    written += len(scores)
+        phase.rows += written
+    return written
+
+
+@instrumentation.phase('refresh')
+def _refresh_similarity_rows(storage, similarity_pairs, ids, touched_ids, k):
+    """
+    Пересчитать сходство только для строк с ID из touched_ids.
+    
+    Полностью пересчитываются измененные строки и строки, у которых среди
+    сохраненных соседей есть измененные (они могли потерять соседа). Так как
+    сходство симметрично, тот же расчет дает новые значения сходства остальных
+    строк с измененными: они объединяются с сохраненными парами этих строк,
+    после чего снова оставляются k лучших. Записи прочих строк не меняются.
+    
+    storage - хранилище сходства (см. similarity_storage.py);
+    similarity_pairs(rows=...) - расчет сходства строк rows со всеми строками,
+    генератор пар, как у _cosine_similarity_pairs
+    """
+    touched = ids[np.isin(ids, list(touched_ids))]
+    if len(touched) == 0:
+        return
+    
+    # 1. Строки, которые пересчитываются полностью
+    linked = storage.linked(touched.tolist())
+    recompute_rows = np.flatnonzero(np.isin(ids, np.union1d(touched, linked)))
+    recompute = ids[recompute_rows]
+    
+    # Новое сходство этих строк со всеми строками (только положительное)
+    parts = list(similarity_pairs(rows=recompute_rows))
+    rows = np.concatenate([part[0] for part in parts])
+    columns = np.concatenate([part[1] for part in parts])
+    scores = np.concatenate([part[2] for part in parts])
+    ids_a, ids_b = ids[rows], ids[columns]
+    
+    # 2. Остальные строки, у которых изменилось сходство с измененными строками
+    reverse = np.isin(ids_a, touched) & ~np.isin(ids_b, recompute)
+    merged = np.unique(ids_b[reverse])
+    
+    # Сохраненные пары этих строк (среди них нет пар с измененными строками)
+    stored_a, stored_b, stored_scores = storage.stored_pairs(merged.tolist())
+    
+    all_a = np.concatenate([ids_a, ids_b[reverse], stored_a])
+    all_b = np.concatenate([ids_b, ids_a[reverse], stored_b])
+    all_scores = np.concatenate([scores, scores[reverse], stored_scores])
+    
+    # 3. Оставляем для каждой строки k самых похожих
+    all_a, all_b, all_scores = _top_k_per_row(all_a, all_b, all_scores, k)
+    
+    # 4. Заменяем записи затронутых строк
+    storage.replace(recompute.tolist() + merged.tolist(), all_a, all_b, all_scores)
+
+
+def _top_k_per_row(rows, columns, scores, k):
+    """
+    Оставить для каждой строки не более k пар с наибольшим сходством
+    """
+    order = np.lexsort((-scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    
+    if k and len(rows):
+        group_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        ranks = np.arange(len(rows)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(rows)]))
+        keep = ranks < k
+        rows, columns, scores = rows[keep], columns[keep], scores[keep]
+    
+    return rows, columns, scores
+
+
+def _recommendation_type(sources):
+    """
+    Определить тип рекомендации по списку ее источников
+    """
+    return 'hybrid' if len(sources) > 1 else sources[0]
+
+
+def _write_recommendation_changes(targets):
+    """
+    Записать новые списки рекомендаций пользователей.
+    
+    targets - словарь {user_id: {track_id: (score, recommendation_type)}}.
+    Сохраненные списки сравниваются с новыми в одной транзакции: оценки и типы
+    существующих рекомендаций обновляются на месте (флаги is_shown и
+    is_interacted сохраняются), добавляются только новые треки и удаляются
+    только выпавшие. У пользователей, чей список пересчитан без новых и
+    измененных оценок, обновляется только время updated_at - по нему
+    определяется, устарели ли сохраненные рекомендации
+    """
+    now = timezone.now()
+    
+    with transaction.atomic():
+        existing = UserTrackRecommendation.objects.filter(
+            user_id__in=list(targets)
+        ).only('id', 'user_id', 'track_id', 'score', 'recommendation_type')
+        
+        to_update = []
+        to_delete = []
+        kept = set()
+        
+        for rec in existing:
+            target = targets[rec.user_id]
+            key = (rec.user_id, rec.track_id)
+            
+            # Трек выпал из рекомендаций или встретился повторно с другим типом
+            if rec.track_id not in target or key in kept:
+                to_delete.append(rec.id)
+                continue
+            
+            kept.add(key)
+            score, recommendation_type = target[rec.track_id]
+            
+            if not math.isclose(rec.score, score, rel_tol=1e-9) or rec.recommendation_type != recommendation_type:
+                rec.score = score
+                rec.recommendation_type = recommendation_type
+                rec.updated_at = now
+                to_update.append(rec)
+        
+        to_create = [
+            UserTrackRecommendation(
+                user_id=user_id,
+                track_id=track_id,
+                score=score,
+                recommendation_type=recommendation_type,
+                is_shown=False,
+                is_interacted=False
+            )
+            for user_id, target in targets.items()
+            for track_id, (score, recommendation_type) in target.items()
+            if (user_id, track_id) not in kept
+        ]
+        
+        # Удаляем только выпавшие рекомендации
+        for start in range(0, len(to_delete), 1000):
+            UserTrackRecommendation.objects.filter(id__in=to_delete[start:start + 1000]).delete()
+        
+        # Обновляем изменившиеся оценки на месте
+        if to_update:
+            UserTrackRecommendation.objects.bulk_update(
+                to_update, ['score', 'recommendation_type', 'updated_at'], batch_size=1000
+            )
+        
+        # Добавляем новые треки
+        if to_create:
+            UserTrackRecommendation.objects.bulk_create(to_create, batch_size=1000)
+    
+    # Отмечаем время пересчета у пользователей, чьи оценки не изменились. Отметка
+    # пишется отдельными запросами вне транзакции: транзакция без изменений остается
+    # только читающей и не ждет блокировки записи (SQLite)
+    changed_users = {rec.user_id for rec in to_update} | {rec.user_id for rec in to_create}
+    confirmed_users = [user_id for user_id in targets if user_id not in changed_users]
+    for start in range(0, len(confirmed_users), 1000):
+        UserTrackRecommendation.objects.filter(
+            user_id__in=confirmed_users[start:start + 1000]
+        ).update(updated_at=now)
 
 
 class RecommendationEngine:
@@ -23,288 +463,294 @@ class RecommendationEngine:
     def __init__(self):
         self.MIN_INTERACTIONS = 3  # Минимальное количество взаимодействий для рекомендаций
         self.MAX_RECOMMENDATIONS = 50  # Максимальное количество рекомендаций
+        self.MAX_NEIGHBOURS = 50  # Количество похожих пользователей для коллаборативной фильтрации
     
-    def get_recommendations_for_user(self, user_id, limit=20):
+    @instrumentation.phase('recommendations')
+    def get_recommendations_for_user(self, user_id, limit=20, use_cache=True):
         """
-        Получить рекомендации для конкретного пользователя
+        Получить рекомендации для конкретного пользователя.
+        
+        Если use_cache=True и в кэше есть актуальный список, он возвращается без
+        пересчета и без перезаписи сохраненных рекомендаций
         """
-        user = User.objects.get(id=user_id)
+        if use_cache:
+            cached = recommendation_cache.get(user_id, limit)
+            if cached is not None:
+                return self._build_result(cached)
+        
+        # Один раз загружаем данные пользователя для всех источников рекомендаций
+        with instrumentation.phase('profile'):
+            profile = UserProfileSnapshot.build(user_id)
         
         # Проверяем, есть ли у пользователя достаточно взаимодействий
-        interactions_count = UserTrackInteraction.objects.filter(
-            user=user, 
-            interaction_type__in=['play', 'like']
-        ).count()
-        
-        if interactions_count < self.MIN_INTERACTIONS:
-            # Если недостаточно данных, используем популярные треки
-            return self.get_popular_recommendations(user_id, limit)
-        
-        # Объединяем рекомендации из разных источников
-        recommendations = {}
-        
-        # 1. Получаем рекомендации на основе коллаборативной фильтрации
-        collab_recs = self.get_collaborative_recommendations(user_id, limit)
-        for track_id, score in collab_recs.items():
-            if track_id not in recommendations:
-                recommendations[track_id] = {'score': 0, 'sources': []}
-            recommendations[track_id]['score'] += score * 0.5  # Вес коллаборативных рекомендаций
-            recommendations[track_id]['sources'].append('collaborative')
-        
-        # 2. Получаем рекомендации на основе контентной фильтрации
-        content_recs = self.get_content_based_recommendations(user_id, limit)
-        for track_id, score in content_recs.items():
-            if track_id not in recommendations:
-                recommendations[track_id] = {'score': 0, 'sources': []}
-            recommendations[track_id]['score'] += score * 0.3  # Вес контентных рекомендаций
-            recommendations[track_id]['sources'].append('content_based')
-        
-        # 3. Добавляем популярные треки с меньшим весом
-        popular_recs = self.get_popular_recommendations(user_id, limit)
-        for track_id, score in popular_recs.items():
-            if track_id not in recommendations:
-                recommendations[track_id] = {'score': 0, 'sources': []}
-            recommendations[track_id]['score'] += score * 0.2  # Вес популярных рекомендаций
-            recommendations[track_id]['sources'].append('popularity')
-        
-        # Сортируем треки по весу и возвращаем топ limit
-        sorted_recommendations = sorted(
-            recommendations.items(), 
-            key=lambda x: x[1]['score'], 
-            reverse=True
-        )[:limit]
+        if profile.interaction_count < self.MIN_INTERACTIONS:
+            # Если недостаточно данных, используем только популярные треки
+            sources = [
+                ('popularity', self.get_popular_recommendations(user_id, limit, profile=profile), 1.0),
+            ]
+        else:
+            # Объединяем рекомендации из разных источников с весами
+            sources = [
+                ('collaborative', self.get_collaborative_recommendations(user_id, limit, profile=profile), 0.5),
+                ('content_based', self.get_content_based_recommendations(user_id, limit, profile=profile), 0.3),
+                ('popularity', self.get_popular_recommendations(user_id, limit, profile=profile), 0.2),
+            ]
         
-        # Получаем объекты треков
-        track_ids = [track_id for track_id, _ in sorted_recommendations]
-        tracks = Track.objects.filter(id__in=track_ids)
+        track_ids, scores, track_sources = self.merge_recommendations(sources, limit)
+        items = list(zip(track_ids.tolist(), scores.tolist(), track_sources))
+        
+        result = self._build_result(items)
         
-        # Создаем словарь с треками
-        track_dict = {track.id: track for track in tracks}
+        # Сохраняем рекомендации в базу и в кэш
+        self.save_recommendations(user_id, result)
+        recommendation_cache.set(user_id, limit, items, profile.last_interaction_id)
+        
+        return result
+    
+    def _build_result(self, items):
+        """
+        Сформировать результат из списка (track_id, score, sources)
+        """
+        # Получаем объекты треков
+        track_dict = Track.objects.in_bulk([track_id for track_id, _, _ in items])
         
-        # Формируем результат
         result = []
-        for track_id, rec_data in sorted_recommendations:
+        for track_id, score, sources in items:
             if track_id in track_dict:
                 result.append({
                     'track': track_dict[track_id],
-                    'score': rec_data['score'],
-                    'sources': rec_data['sources']
+                    'score': score,
+                    'sources': sources
                 })
+        return result
+    
+    def get_stored_recommendations(self, user_id, limit=20):
+        """
+        Получить ранее сохраненные рекомендации без пересчета.
         
-        # Сохраняем рекомендации в базу
-        self.save_recommendations(user_id, result)
+        Возвращает результат в том же формате, что и get_recommendations_for_user,
+        и время последнего обновления рекомендаций (None, если их нет)
+        """
+        stored = UserTrackRecommendation.objects.filter(
+            user_id=user_id
+        ).select_related('track').order_by('-score')[:limit]
         
-        return result
+        result = []
+        updated_at = None
+        for rec in stored:
+            result.append({
+                'track': rec.track,
+                'score': rec.score,
+                'sources': [rec.recommendation_type]
+            })
+            if updated_at is None or rec.updated_at > updated_at:
+                updated_at = rec.updated_at
+        
+        return result, updated_at
     
-    def get_collaborative_recommendations(self, user_id, limit=20):
+    @instrumentation.phase('merge')
+    def merge_recommendations(self, sources, limit):
         """
-        Получить рекомендации на основе коллаборативной фильтрации
+        Объединить рекомендации из разных источников.
+        
+        sources - список (название, (track_ids, scores), вес). Оценки складываются
+        по объединению кандидатов всех источников, затем выбирается топ limit.
+        Возвращает массивы ID треков и оценок, а также список источников каждого трека
         """
-        # 1. Получаем треки, которые пользователь уже лайкнул или прослушал
-        user_interaction_track_ids = UserTrackInteraction.objects.filter(
-            user_id=user_id, 
-            interaction_type__in=['play', 'like']
-        ).values_list('track_id', flat=True).distinct()
+        all_ids = np.concatenate([ids for _, (ids, _), _ in sources])
+        if len(all_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0), []
+        
+        weighted_scores = np.concatenate([scores * weight for _, (_, scores), weight in sources])
+        
+        # Выравниваем кандидатов всех источников и суммируем их взвешенные оценки
+        union_ids, inverse = np.unique(all_ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=weighted_scores, minlength=len(union_ids))
+        
+        # При равных оценках сохраняем порядок, в котором треки предложили источники
+        first_seen = np.full(len(union_ids), len(all_ids))
+        np.minimum.at(first_seen, inverse, np.arange(len(all_ids)))
+        
+        top = _top_k(totals, limit, tiebreak=first_seen)
+        top_ids = union_ids[top]
+        
+        # Определяем источники выбранных треков
+        source_masks = [(name, np.isin(top_ids, ids)) for name, (ids, _), _ in sources]
+        track_sources = [
+            [name for name, mask in source_masks if mask[idx]]
+            for idx in range(len(top_ids))
+        ]
+        
+        return top_ids, totals[top], track_sources
+    
+    @instrumentation.phase('collaborative')
+    def get_collaborative_recommendations(self, user_id, limit=20, profile=None):
+        """
+        Получить рекомендации на основе коллаборативной фильтрации.
+        Возвращает массивы ID треков и оценок, упорядоченные по убыванию оценки
+        """
+        # 1. Треки, которые пользователь уже лайкнул или прослушал, берем из снимка
+        if profile is None:
+            profile = UserProfileSnapshot.build(user_id)
+        
+        if getattr(settings, 'RECOMMENDATION_COLLABORATIVE_BACKEND', 'similarity') == 'als':
+            # Оценки по факторам матричной факторизации
+            return MatrixFactorizationEngine().get_recommendations(
+                user_id, limit, exclude=profile.interacted_track_ids
+            )
         
         # 2. Находим похожих пользователей
-        similar_users = UserSimilarity.objects.filter(
-            user_a_id=user_id
-        ).order_by('-similarity_score')[:50]
+        neighbour_ids, similarity_scores = user_similarity_storage().neighbours(user_id, self.MAX_NEIGHBOURS)
         
-        # Словарь для хранения рекомендаций {track_id: score}
-        recommendations = defaultdict(float)
+        if len(neighbour_ids) == 0:
+            return _empty_recommendations()
         
-        # 3. Проходим по похожим пользователям и собираем их лайкнутые/прослушанные треки
-        for user_similarity in similar_users:
-            similar_user_id = user_similarity.user_b_id
-            similarity_score = user_similarity.similarity_score
-            
-            # Находим все треки, которые послушал/лайкнул похожий пользователь
-            similar_user_interactions = UserTrackInteraction.objects.filter(
-    user_id=similar_user_id,
-    interaction_type__in=['play', 'like']
-).exclude(track_id__in=user_interaction_track_ids)
-            
-            
-            # Добавляем треки в рекомендации
-            for interaction in similar_user_interactions:
-                track_id = interaction.track_id
-                
-                # Вес взаимодействия
-                interaction_weight = 1.0
-                if interaction.interaction_type == 'like':
-                    interaction_weight = 2.0  # Лайк имеет больший вес
-                
-                # Добавляем вес трека в рекомендации
-                recommendations[track_id] += similarity_score * interaction_weight
+        # 3. Берем разреженную матрицу пользователи x треки из памяти процесса
+        matrix = interaction_matrix.get()
+        
+        rows, found = matrix.user_rows(neighbour_ids)
+        if not found.any():
+            return _empty_recommendations()
+        
+        # 4. Оценка трека - сумма весов взаимодействий соседей, умноженных на их сходство
+        scores = matrix.weights[rows[found]].T.dot(similarity_scores[found])
+        
+        # 5. Исключаем треки, которые пользователь уже слушал
+        columns, known = matrix.track_columns(list(profile.interacted_track_ids))
+        scores[columns[known]] = 0.0
+        
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return _empty_recommendations()
         
         # Нормализуем оценки от 0 до 1
-        if recommendations:
-            max_score = max(recommendations.values())
-            if max_score > 0:
-                for track_id in recommendations:
-                    recommendations[track_id] /= max_score
+        candidate_scores = scores[candidates] / scores[candidates].max()
         
         # Возвращаем топ треков
-        return dict(sorted(
-            recommendations.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )[:limit])
+        top = _top_k(candidate_scores, limit)
+        return matrix.track_ids[candidates[top]], candidate_scores[top]
     
-    def get_content_based_recommendations(self, user_id, limit=20):
+    @instrumentation.phase('content_based')
+    def get_content_based_recommendations(self, user_id, limit=20, profile=None):
         """
-        Получить рекомендации на основе контентной фильтрации (по жанрам и аудио-характеристикам)
+        Получить рекомендации на основе контентной фильтрации (по жанрам и аудио-характеристикам).
+        Возвращает массивы ID треков и оценок, упорядоченные по убыванию оценки
         """
-        # 1. Находим любимые жанры пользователя
-        user_genres = {}
+        if profile is None:
+            profile = UserProfileSnapshot.build(user_id)
         
-        # Получаем явные предпочтения пользователя (жанры)
-        explicit_preferences = UserPreference.objects.filter(user_id=user_id)
-        for pref in explicit_preferences:
-            user_genres[pref.genre_id] = pref.weight
+        # 1. Явные предпочтения пользователя (жанры) и треки,
+        # которые пользователь уже слушал или лайкнул, берем из снимка
+        user_genres = profile.genre_weights
         
-        # Если явных предпочтений нет, определяем их на основе прослушиваний
-        if not user_genres:
-            # Получаем все взаимодействия пользователя
-            user_interactions = UserTrackInteraction.objects.filter(
-                user_id=user_id,
-                interaction_type__in=['play', 'like']
-            )
-            
-            # Собираем ID треков, с которыми взаимодействовал пользователь
-            track_ids = user_interactions.values_list('track_id', flat=True).distinct()
-            
-            # Получаем все жанры этих треков и считаем их частоту
-            genre_counts = {}
-            for track in Track.objects.filter(id__in=track_ids).prefetch_related('genres'):
-                for genre in track.genres.all():
-                    genre_counts[genre.id] = genre_counts.get(genre.id, 0) + 1
-            
-            # Нормализуем частоты для получения весов
-            if genre_counts:
-                max_count = max(genre_counts.values())
-                for genre_id, count in genre_counts.items():
-                    user_genres[genre_id] = count / max_count
-        
-        # 2. Получаем треки, которые пользователь уже слушал или лайкнул
-        user_interaction_track_ids = UserTrackInteraction.objects.filter(
-            user_id=user_id, 
-            interaction_type__in=['play', 'like']
-        ).values_list('track_id', flat=True).distinct()
-        
-        # 3. Ищем треки с похожими жанрами, которые пользователь еще не слушал
-        recommendations = defaultdict(float)
-        
-        # Получаем все треки, которые пользователь еще не слушал
-        all_tracks = Track.objects.filter(
-            is_published=True
-        ).exclude(
-            id__in=user_interaction_track_ids
-        ).prefetch_related('genres')
-        
-        # Для каждого трека вычисляем его релевантность на основе жанров
-        for track in all_tracks:
-            track_genres = list(track.genres.all())
-            
-            # Если у трека нет жанров, пропускаем его
-            if not track_genres:
-                continue
-            
-            # Вычисляем релевантность трека
-            relevance = 0
-            for genre in track_genres:
-                genre_weight = user_genres.get(genre.id, 0)
-                relevance += genre_weight
-            
-            # Нормализуем релевантность по количеству жанров трека
-            if track_genres:
-                relevance /= len(track_genres)
-            
-            # Добавляем релевантность трека в рекомендации
-            recommendations[track.id] = relevance
+        # Матрица треки x жанры из памяти процесса
+        matrix = track_genre_matrix.get()
+        if matrix.binary.shape[0] == 0:
+            return _empty_recommendations()
+        
+        interacted_rows, interacted_found = matrix.track_rows(list(profile.interacted_track_ids))
+        interacted_rows = interacted_rows[interacted_found]
+        
+        # Вектор весов жанров пользователя
+        genre_weights = np.zeros(len(matrix.genre_ids))
+        
+        if user_genres:
+            columns, found = matrix.genre_columns(list(user_genres))
+            weights = np.fromiter(user_genres.values(), dtype=np.float64, count=len(user_genres))
+            genre_weights[columns[found]] = weights[found]
+        else:
+            # Если явных предпочтений нет, определяем их на основе прослушиваний:
+            # считаем частоту жанров среди треков пользователя
+            genre_counts = np.asarray(matrix.binary[interacted_rows].sum(axis=0)).ravel()
+            if genre_counts.size and genre_counts.max() > 0:
+                genre_weights = genre_counts / genre_counts.max()
+        
+        # 2. Релевантность трека - сумма весов его жанров, деленная на количество жанров
+        scores = matrix.normalized.dot(genre_weights)
+        
+        # Рекомендуем только опубликованные треки, которые пользователь еще не слушал
+        candidate_mask = matrix.is_published.copy()
+        candidate_mask[interacted_rows] = False
+        candidates = np.flatnonzero(candidate_mask)
+        
+        if len(candidates) == 0:
+            return _empty_recommendations()
+        
+        candidate_scores = scores[candidates]
         
         # Нормализуем оценки от 0 до 1
-        if recommendations:
-            max_score = max(recommendations.values())
-            if max_score > 0:
-                for track_id in recommendations:
-                    recommendations[track_id] /= max_score
+        max_score = candidate_scores.max()
+        if max_score > 0:
+            candidate_scores = candidate_scores / max_score
+        
+        # Выбираем топ треков; при равных оценках выше идут более новые треки
+        candidate_ids = matrix.track_ids[candidates]
+        top = _top_k(candidate_scores, limit, tiebreak=-candidate_ids)
+        return candidate_ids[top], candidate_scores[top]
+    
+    @instrumentation.phase('popularity')
+    def get_popular_recommendations(self, user_id, limit=20, profile=None):
+        """
+        Получить рекомендации на основе популярности треков.
+        Возвращает массивы ID треков и оценок, упорядоченные по убыванию популярности
+        """
+        # Треки, которые пользователь уже слушал или лайкнул, берем из снимка
+        if profile is None:
+            profile = UserProfileSnapshot.build(user_id)
+        
+        # Получаем популярные треки, которые пользователь еще не слушал,
+        # из рейтинга в памяти процесса
+        popular_tracks = popularity_leaderboard.top(limit, exclude=profile.interacted_track_ids)
+        return self.score_popular_tracks(popular_tracks, limit)
+    
+    def score_popular_tracks(self, popular_tracks, limit):
+        """
+        Рассчитать оценки популярности для списка (track_id, play_count, like_count) из рейтинга
+        """
+        if not popular_tracks:
+            return _empty_recommendations()
         
-        # Возвращаем топ треков
-        return dict(sorted(
-            recommendations.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )[:limit])
-    
-    def get_popular_recommendations(self, user_id, limit=20):
-        """
-        Получить рекомендации на основе популярности треков
-        """
-        # Получаем треки, которые пользователь уже слушал или лайкнул
-        user_interaction_track_ids = UserTrackInteraction.objects.filter(
-            user_id=user_id, 
-            interaction_type__in=['play', 'like']
-        ).values_list('track_id', flat=True).distinct()
-        
-        # Получаем популярные треки, которые пользователь еще не слушал
-        popular_tracks = Track.objects.filter(
-            is_published=True
-        ).exclude(
-            id__in=user_interaction_track_ids
-        ).order_by('-play_count', '-like_count')[:limit]
-        
-        # Формируем рекомендации
-        recommendations = {}
-        
-        # Если есть популярные треки, нормализуем их оценки
-        max_plays = Track.objects.aggregate(max_plays=models.Max('play_count'))['max_plays'] or 1
-        
-        for idx, track in enumerate(popular_tracks):
-            # Нормализуем популярность от 0 до 1
-            popularity = (track.play_count / max_plays) + (limit - idx) / (limit * 10)
-            popularity = min(1.0, popularity)  # Ограничиваем максимальным значением 1.0
-            
-            recommendations[track.id] = popularity
+        track_ids = np.array([track_id for track_id, _, _ in popular_tracks], dtype=np.int64)
+        play_counts = np.array([play_count for _, play_count, _ in popular_tracks], dtype=np.float64)
         
-        return recommendations
+        # Нормализуем популярность от 0 до 1 с небольшим бонусом за позицию в рейтинге
+        max_plays = popularity_leaderboard.max_play_count() or 1
+        positions = np.arange(len(track_ids))
+        scores = play_counts / max_plays + (limit - positions) / (limit * 10)
+        
+        # Ограничиваем максимальным значением 1.0
+        return track_ids, np.minimum(scores, 1.0)
     
+    @instrumentation.phase('save')
     def save_recommendations(self, user_id, recommendations):
         """
-        Сохранить рекомендации в базу данных
+        Сохранить рекомендации в базу данных: записываются только изменения
+        по сравнению с сохраненным списком (см. _write_recommendation_changes)
         """
-        # Преобразуем рекомендации в формат для сохранения
-        recommendations_to_save = []
-        for rec in recommendations:
-            track = rec['track']
-            score = rec['score']
-            sources = rec['sources']
-            
-            # Определяем тип рекомендации
-            if len(sources) > 1:
-                recommendation_type = 'hybrid'
-            else:
-                recommendation_type = sources[0]
-            
-            # Создаем объект рекомендации
-            recommendations_to_save.append(
-                UserTrackRecommendation(
-                    user_id=user_id,
-                    track=track,
-                    score=score,
-                    recommendation_type=recommendation_type,
-                    is_shown=False,
-                    is_interacted=False
-                )
-            )
+        # Преобразуем рекомендации в формат {track_id: (score, recommendation_type)}
+        target = {
+            rec['track'].id: (rec['score'], _recommendation_type(rec['sources']))
+            for rec in recommendations
+        }
+        
+        _write_recommendation_changes({user_id: target})
+    
+    def mark_shown(self, user_id, track_ids):
+        """
+        Пометить рекомендации как показанные пользователю одним запросом.
+        
+        Если включена настройка RECOMMENDATION_IMPRESSION_BUFFER, показы
+        накапливаются в буфере и записываются в базу пакетами
+        """
+        track_ids = list(track_ids)
+        if not track_ids:
+            return 0
         
-        # Удаляем старые рекомендации для этого пользователя
-        UserTrackRecommendation.objects.filter(user_id=user_id).delete()
+        if getattr(settings, 'RECOMMENDATION_IMPRESSION_BUFFER', False):
+            impression_buffer.add(user_id, track_ids)
+            return len(track_ids)
         
-        # Сохраняем новые рекомендации
-        if recommendations_to_save:
-            UserTrackRecommendation.objects.bulk_create(recommendations_to_save)
+        return mark_recommendations_shown(user_id, track_ids)
     
     def mark_recommendation_as_shown(self, user_id, track_id):
         """
@@ -331,164 +777,694 @@ class RecommendationEngine:
             return False
 
 
+class BatchRecommendationEngine:
+    """
+    Пакетный расчет рекомендаций для всех пользователей.
+    
+    Матрицы взаимодействий, сходства пользователей, жанров и предпочтений
+    загружаются из базы один раз, после чего пользователи обрабатываются порциями
+    с помощью матричного умножения. Результаты записываются пакетными вставками
+    """
+    
+    def __init__(self, limit=20, chunk_size=200):
+        self.engine = RecommendationEngine()
+        self.limit = limit
+        self.chunk_size = chunk_size
+        
+        self.interactions = None  # Матрица пользователи x треки
+        self.genres = None  # Матрица треки x жанры
+        self.similarity = None  # Матрица сходства пользователей (в строках матрицы взаимодействий)
+        self.preferences = None  # Явные предпочтения пользователей x жанры
+        self.has_preferences = None  # Маска пользователей с явными предпочтениями
+        self.track_genre_rows = None  # Соответствие столбцов матрицы взаимодействий строкам матрицы жанров
+    
+    @instrumentation.phase('batch_load')
+    def load(self):
+        """
+        Загрузить из базы все данные, необходимые для расчета
+        """
+        self.interactions = interactions = interaction_matrix.build()
+        self.genres = genres = track_genre_matrix.build()
+        n_users = len(interactions.user_ids)
+        
+        # 1. Сходство пользователей: как и при расчете для одного пользователя,
+        # берем MAX_NEIGHBOURS самых похожих соседей
+        user_a, user_b, scores = user_similarity_storage().pairs()
+        count = len(scores)
+        
+        # Номер соседа внутри группы одного пользователя
+        group_starts = np.flatnonzero(np.r_[True, user_a[1:] != user_a[:-1]]) if count else np.empty(0, dtype=np.intp)
+        group_sizes = np.diff(np.r_[group_starts, count])
+        ranks = np.arange(count) - np.repeat(group_starts, group_sizes)
+        
+        rows_a, found_a = interactions.user_rows(user_a)
+        rows_b, found_b = interactions.user_rows(user_b)
+        keep = (ranks < self.engine.MAX_NEIGHBOURS) & found_a & found_b
+        
+        self.similarity = sparse.csr_matrix(
+            (scores[keep], (rows_a[keep], rows_b[keep])),
+            shape=(n_users, n_users)
+        )
+        
+        # 2. Явные предпочтения пользователей
+        preferences = list(UserPreference.objects.values_list('user_id', 'genre_id', 'weight'))
+        
+        count = len(preferences)
+        pref_users = np.fromiter((row[0] for row in preferences), dtype=np.int64, count=count)
+        pref_genres = np.fromiter((row[1] for row in preferences), dtype=np.int64, count=count)
+        pref_weights = np.fromiter((row[2] for row in preferences), dtype=np.float64, count=count)
+        
+        user_rows, user_found = interactions.user_rows(pref_users)
+        genre_columns, genre_found = genres.genre_columns(pref_genres)
+        keep = user_found & genre_found
+        
+        self.preferences = sparse.csr_matrix(
+            (pref_weights[keep], (user_rows[keep], genre_columns[keep])),
+            shape=(n_users, len(genres.genre_ids))
+        )
+        self.has_preferences = np.zeros(n_users, dtype=bool)
+        self.has_preferences[user_rows[user_found]] = True
+        
+        # 3. Соответствие треков матрицы взаимодействий строкам матрицы жанров
+        genre_rows, genre_found = genres.track_rows(interactions.track_ids)
+        self.track_genre_rows = sparse.csr_matrix(
+            (
+                np.ones(int(genre_found.sum())),
+                (np.flatnonzero(genre_found), genre_rows[genre_found])
+            ),
+            shape=(len(interactions.track_ids), len(genres.track_ids))
+        )
+    
+    # Массивы, которые передаются фоновым процессам через файлы
+    SHARED_ARRAYS = (
+        'interaction_weights', 'interaction_user_ids', 'interaction_track_ids', 'interaction_counts',
+        'genre_binary', 'genre_normalized', 'genre_track_ids', 'genre_ids', 'genre_is_published',
+        'similarity', 'preferences', 'has_preferences', 'track_genre_rows',
+    )
+    
+    def dump(self, directory):
+        """
+        Сохранить загруженные данные в каталог для совместного использования процессами
+        """
+        arrays = {
+            'interaction_weights': self.interactions.weights,
+            'interaction_user_ids': self.interactions.user_ids,
+            'interaction_track_ids': self.interactions.track_ids,
+            'interaction_counts': self.interactions.interaction_counts,
+            'genre_binary': self.genres.binary,
+            'genre_normalized': self.genres.normalized,
+            'genre_track_ids': self.genres.track_ids,
+            'genre_ids': self.genres.genre_ids,
+            'genre_is_published': self.genres.is_published,
+            'similarity': self.similarity,
+            'preferences': self.preferences,
+            'has_preferences': self.has_preferences,
+            'track_genre_rows': self.track_genre_rows,
+        }
+        
+        for name, array in arrays.items():
+            if sparse.issparse(array):
+                # Разреженная матрица хранится как три массива и форма
+                np.save(os.path.join(directory, f'{name}.data.npy'), array.data)
+                np.save(os.path.join(directory, f'{name}.indices.npy'), array.indices)
+                np.save(os.path.join(directory, f'{name}.indptr.npy'), array.indptr)
+                np.save(os.path.join(directory, f'{name}.shape.npy'), np.array(array.shape))
+            else:
+                np.save(os.path.join(directory, f'{name}.npy'), array)
+    
+    def load_shared(self, directory):
+        """
+        Загрузить данные, сохраненные dump(), отображая файлы в память (без копирования)
+        """
+        arrays = {}
+        for name in self.SHARED_ARRAYS:
+            path = os.path.join(directory, f'{name}.npy')
+            if os.path.exists(path):
+                arrays[name] = np.load(path, mmap_mode='r')
+            else:
+                arrays[name] = sparse.csr_matrix(
+                    (
+                        np.load(os.path.join(directory, f'{name}.data.npy'), mmap_mode='r'),
+                        np.load(os.path.join(directory, f'{name}.indices.npy'), mmap_mode='r'),
+                        np.load(os.path.join(directory, f'{name}.indptr.npy'), mmap_mode='r'),
+                    ),
+                    shape=tuple(np.load(os.path.join(directory, f'{name}.shape.npy'))),
+                    copy=False
+                )
+        
+        self.interactions = InteractionMatrixData(
+            arrays['interaction_weights'],
+            arrays['interaction_user_ids'],
+            arrays['interaction_track_ids'],
+            arrays['interaction_counts'],
+        )
+        self.genres = TrackGenreMatrixData(
+            arrays['genre_binary'],
+            arrays['genre_normalized'],
+            arrays['genre_track_ids'],
+            arrays['genre_ids'],
+            arrays['genre_is_published'],
+        )
+        self.similarity = arrays['similarity']
+        self.preferences = arrays['preferences']
+        self.has_preferences = arrays['has_preferences']
+        self.track_genre_rows = arrays['track_genre_rows']
+    
+    def run_parallel(self, workers, progress=None):
+        """
+        Рассчитать рекомендации для всех пользователей в нескольких процессах.
+        
+        Пользователи делятся на диапазоны ID (по несколько на процесс для равномерной
+        загрузки). Данные загружаются из базы один раз и передаются процессам через
+        файлы, отображенные в память.
+        
+        progress - функция progress(shard, processed, elapsed), вызываемая после
+        завершения каждого диапазона, где shard - кортеж (первый ID, последний ID).
+        Возвращает количество обработанных пользователей и затраченное время
+        """
+        start_time = time.time()
+        
+        if self.interactions is None:
+            self.load()
+        
+        user_ids = np.fromiter(User.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        if len(user_ids) == 0:
+            return 0, time.time() - start_time
+        
+        shards = [
+            (int(shard[0]), int(shard[-1]))
+            for shard in np.array_split(user_ids, min(workers * 4, len(user_ids)))
+        ]
+        
+        processed = 0
+        with tempfile.TemporaryDirectory(prefix='recommendations-') as directory:
+            self.dump(directory)
+            
+            with create_process_pool(workers) as pool:
+                futures = {
+                    pool.submit(
+                        run_batch_shard, directory, first_id, last_id, self.limit, self.chunk_size
+                    ): (first_id, last_id)
+                    for first_id, last_id in shards
+                }
+                
+                for future in as_completed(futures):
+                    shard_processed, shard_time = future.result()
+                    processed += shard_processed
+                    
+                    if progress:
+                        progress(futures[future], shard_processed, shard_time)
+        
+        return processed, time.time() - start_time
+    
+    def run(self, user_ids=None, progress=None):
+        """
+        Рассчитать и сохранить рекомендации для пользователей (по умолчанию для всех).
+        
+        progress - функция progress(processed, total, elapsed), вызываемая после каждой порции.
+        Возвращает количество обработанных пользователей и затраченное время
+        """
+        start_time = time.time()
+        
+        if self.interactions is None:
+            self.load()
+        
+        if user_ids is None:
+            user_ids = User.objects.order_by('id').values_list('id', flat=True)
+        user_ids = np.fromiter(user_ids, dtype=np.int64)
+        
+        processed = 0
+        for start in range(0, len(user_ids), self.chunk_size):
+            chunk = user_ids[start:start + self.chunk_size]
+            with instrumentation.phase('batch_score') as phase:
+                results = self.score_users(chunk)
+                phase.rows += len(chunk)
+            with instrumentation.phase('batch_save') as phase:
+                self.save(results)
+                phase.rows += len(results)
+            processed += len(chunk)
+            
+            if progress:
+                progress(processed, len(user_ids), time.time() - start_time)
+        
+        return processed, time.time() - start_time
+    
+    def score_users(self, user_ids):
+        """
+        Рассчитать рекомендации для порции пользователей.
+        Возвращает словарь {user_id: [(track_id, score, sources), ...]}
+        """
+        interactions = self.interactions
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        
+        rows, found = interactions.user_rows(user_ids)
+        
+        # Строки ненайденных пользователей не читаем: при пустой матрице их нет вовсе
+        counts = np.zeros(len(user_ids), dtype=np.int64)
+        counts[found] = interactions.interaction_counts[rows[found]]
+        warm = counts >= self.engine.MIN_INTERACTIONS
+        
+        # Коллаборативные и контентные оценки считаются сразу для всей порции
+        warm_positions = np.flatnonzero(warm)
+        collaborative = dict(zip(warm_positions, self._score_collaborative(rows[warm])))
+        content_based = dict(zip(warm_positions, self._score_content_based(rows[warm])))
+        
+        results = {}
+        for idx, user_id in enumerate(user_ids.tolist()):
+            interacted = set()
+            if found[idx]:
+                user_row = interactions.weights[rows[idx]]
+                interacted = set(interactions.track_ids[user_row.indices].tolist())
+            
+            popular = self.engine.score_popular_tracks(
+                popularity_leaderboard.top(self.limit, exclude=interacted), self.limit
+            )
+            
+            if warm[idx]:
+                sources = [
+                    ('collaborative', collaborative[idx], 0.5),
+                    ('content_based', content_based[idx], 0.3),
+                    ('popularity', popular, 0.2),
+                ]
+            else:
+                sources = [('popularity', popular, 1.0)]
+            
+            track_ids, scores, track_sources = self.engine.merge_recommendations(sources, self.limit)
+            results[user_id] = list(zip(track_ids.tolist(), scores.tolist(), track_sources))
+        
+        return results
+    
+    def _score_collaborative(self, rows):
+        """
+        Коллаборативные оценки для строк матрицы взаимодействий.
+        Возвращает список (track_ids, scores) для каждой строки
+        """
+        if len(rows) == 0:
+            return []
+        
+        interactions = self.interactions
+        
+        if getattr(settings, 'RECOMMENDATION_COLLABORATIVE_BACKEND', 'similarity') == 'als':
+            # Оценки по факторам матричной факторизации, кроме уже прослушанных треков
+            positions, columns = interactions.weights[rows].nonzero()
+            return MatrixFactorizationEngine().score_users(
+                interactions.user_ids[rows],
+                self.limit,
+                exclude=(positions, interactions.track_ids[columns])
+            )
+        
+        # Оценки всех треков для порции: сходство с соседями x веса их взаимодействий
+        scores = self.similarity[rows].dot(interactions.weights).toarray()
+        
+        # Исключаем треки, которые пользователи уже слушали
+        scores[interactions.weights[rows].nonzero()] = 0.0
+        
+        top = _top_k_rows(scores, self.limit)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        row_max = scores.max(axis=1) if scores.shape[1] else np.zeros(len(rows))
+        
+        result = []
+        for idx in range(len(rows)):
+            valid = top_scores[idx] > 0
+            result.append((
+                interactions.track_ids[top[idx][valid]],
+                top_scores[idx][valid] / row_max[idx] if valid.any() else top_scores[idx][valid]
+            ))
+        return result
+    
+    def _score_content_based(self, rows):
+        """
+        Контентные оценки для строк матрицы взаимодействий.
+        Возвращает список (track_ids, scores) для каждой строки
+        """
+        if len(rows) == 0:
+            return []
+        
+        genres = self.genres
+        if genres.binary.shape[0] == 0:
+            return [_empty_recommendations() for _ in rows]
+        
+        # Треки матрицы жанров, которые пользователи уже слушали
+        listened = (self.interactions.weights[rows] > 0).astype(np.float64)
+        interacted = listened.dot(self.track_genre_rows)
+        
+        # Веса жанров: явные предпочтения, а если их нет - частота жанров в прослушанных треках
+        genre_counts = interacted.dot(genres.binary).toarray()
+        counts_max = genre_counts.max(axis=1, keepdims=True) if genre_counts.shape[1] else np.zeros((len(rows), 1))
+        derived = np.divide(genre_counts, counts_max, out=np.zeros_like(genre_counts), where=counts_max > 0)
+        
+        genre_weights = np.where(
+            self.has_preferences[rows][:, None],
+            self.preferences[rows].toarray(),
+            derived
+        )
+        
+        # Релевантность всех треков для порции одним умножением
+        scores = genres.normalized.dot(genre_weights.T).T
+        
+        # Исключаем неопубликованные и уже прослушанные треки
+        scores[:, ~genres.is_published] = -np.inf
+        scores[interacted.nonzero()] = -np.inf
+        
+        # При равных оценках выше идут более новые треки
+        top = _top_k_rows(scores, self.limit, tiebreak=-genres.track_ids)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        row_max = scores.max(axis=1)
+        
+        result = []
+        for idx in range(len(rows)):
+            valid = np.isfinite(top_scores[idx])
+            row_scores = top_scores[idx][valid]
+            if row_max[idx] > 0:
+                row_scores = row_scores / row_max[idx]
+            result.append((genres.track_ids[top[idx][valid]], row_scores))
+        return result
+    
+    def save(self, results):
+        """
+        Сохранить рекомендации порции пользователей: изменения записываются
+        по сравнению с сохраненными списками (см. _write_recommendation_changes)
+        """
+        _write_recommendation_changes({
+            user_id: {
+                track_id: (score, _recommendation_type(sources))
+                for track_id, score, sources in items
+            }
+            for user_id, items in results.items()
+        })
+        
+        recommendation_cache.invalidate_many(results)
+
+
 class CollaborativeFilteringEngine:
     """
     Движок коллаборативной фильтрации для обновления сходства между пользователями и треками
     """
     
+    WATERMARK_NAME = 'collaborative'
+    
     def __init__(self):
         self.MIN_INTERACTIONS = 5  # Минимальное количество взаимодействий для расчета сходства
     
-    def update_user_similarities(self):
-        """
-        Обновить матрицу сходства между пользователями
+    def update_similarities(self, incremental=False, user_similarities=True, track_engine=None):
         """
-        # 1. Получаем все взаимодействия пользователей с треками
-        interactions = UserTrackInteraction.objects.filter(
-            interaction_type__in=['play', 'like']
-        ).values('user_id', 'track_id', 'interaction_type')
+        Обновить сходство пользователей (если user_similarities=True) и треков.
         
-        # 2. Преобразуем в DataFrame
-        df = pd.DataFrame(list(interactions))
+        Сходство треков обновляет track_engine.update_track_similarities (по
+        умолчанию - только коллаборативное сходство этим движком; HybridFilteringEngine
+        обновляет сходство треков всех типов).
         
-        # Если нет данных, завершаем
-        if df.empty:
-            return
+        В инкрементальном режиме пересчитываются только пользователи и треки,
+        у которых появились взаимодействия после предыдущего расчета (отметка
+        SimilarityWatermark); если отметки еще нет, выполняется полный пересчет.
+        Возвращает количество пересчитанных пользователей и треков или None,
+        если выполнен полный пересчет
+        """
+        track_engine = track_engine or self
+        
+        interactions = UserTrackInteraction.objects.filter(interaction_type__in=['play', 'like'])
         
-        # 3. Создаем вес для взаимодействий (лайк имеет больший вес, чем прослушивание)
-        df['weight'] = df['interaction_type'].apply(lambda x: 2.0 if x == 'like' else 1.0)
+        # Запоминаем последнее взаимодействие до начала расчета:
+        # более поздние взаимодействия будут учтены при следующем обновлении
+        last_interaction_id = interactions.aggregate(max_id=models.Max('id'))['max_id'] or 0
+        watermark = SimilarityWatermark.objects.filter(name=self.WATERMARK_NAME).first()
         
-        # 4. Создаем сводную таблицу: users x tracks
-        user_item_matrix = df.pivot_table(
-            index='user_id', 
-            columns='track_id', 
-            values='weight', 
-            aggfunc='sum', 
-            fill_value=0
+        if incremental and watermark is not None:
+            changed = interactions.filter(
+                id__gt=watermark.last_interaction_id,
+                id__lte=last_interaction_id
+            )
+            user_ids = set(changed.values_list('user_id', flat=True).distinct())
+            track_ids = set(changed.values_list('track_id', flat=True).distinct())
+            
+            if user_similarities:
+                self.update_user_similarities(user_ids)
+            track_engine.update_track_similarities(track_ids)
+            result = (len(user_ids), len(track_ids))
+        else:
+            if user_similarities:
+                self.update_user_similarities()
+            track_engine.update_track_similarities()
+            result = None
+        
+        SimilarityWatermark.objects.update_or_create(
+            name=self.WATERMARK_NAME,
+            defaults={'last_interaction_id': last_interaction_id}
         )
+        return result
+    
+    @instrumentation.phase('user_similarity')
+    def update_user_similarities(self, touched_user_ids=None):
+        """
+        Обновить матрицу сходства между пользователями.
         
-        # 5. Фильтруем пользователей с недостаточным количеством взаимодействий
-        user_interaction_counts = user_item_matrix.astype(bool).sum(axis=1)
-        active_users = user_interaction_counts[user_interaction_counts >= self.MIN_INTERACTIONS].index
-        user_item_matrix = user_item_matrix.loc[active_users]
+        Если передан touched_user_ids, пересчитывается только сходство этих
+        пользователей (см. _refresh_similarity_rows)
+        """
+        # 1. Получаем разреженную матрицу пользователи x треки
+        # (лайк имеет больший вес, чем прослушивание)
+        with instrumentation.phase('interactions') as phase:
+            matrix = interaction_matrix.build()
+            phase.rows += matrix.weights.nnz
+        
+        # 2. Фильтруем пользователей с недостаточным количеством прослушанных треков
+        track_counts = np.diff(matrix.weights.indptr)
+        active_rows = np.flatnonzero(track_counts >= self.MIN_INTERACTIONS)
         
         # Если нет активных пользователей, завершаем
-        if len(active_users) == 0:
+        if len(active_rows) == 0:
             return
         
-        # 6. Вычисляем матрицу косинусного сходства между пользователями
-        user_similarity = cosine_similarity(user_item_matrix)
+        user_ids = matrix.user_ids[active_rows]
         
-        # 7. Создаем DataFrame сходства
-        user_similarity_df = pd.DataFrame(
-            user_similarity, 
-            index=user_item_matrix.index, 
-            columns=user_item_matrix.index
+        # Строки пользователей (при включенном SVD - в скрытом пространстве;
+        # при инкрементальном обновлении используется сохраненная проекция)
+        features = _similarity_features(
+            'user_collaborative', matrix.weights[active_rows], matrix.track_ids,
+            refit=touched_user_ids is None
         )
         
-        # 8. Подготавливаем данные для сохранения в базу
-        similarity_records = []
-        
-        # Очищаем старые записи
-        UserSimilarity.objects.all().delete()
-        
-        # Создаем новые записи
-        for user_a in user_similarity_df.index:
-            for user_b in user_similarity_df.columns:
-                if user_a != user_b:  # Исключаем сходство пользователя с самим собой
-                    similarity = user_similarity_df.loc[user_a, user_b]
-                    if similarity > 0:  # Сохраняем только положительное сходство
-                        similarity_records.append(
-                            UserSimilarity(
-                                user_a_id=user_a,
-                                user_b_id=user_b,
-                                similarity_score=similarity
-                            )
-                        )
-        
-        # 9. Сохраняем записи пакетами
-        if similarity_records:
-            batch_size = 1000
-            for i in range(0, len(similarity_records), batch_size):
-                UserSimilarity.objects.bulk_create(
-                    similarity_records[i:i + batch_size]
-                )
+        # 3. Для каждого пользователя оставляем только K самых похожих соседей
+        # (при рекомендациях все равно читаются только они)
+        neighbours = getattr(settings, 'RECOMMENDATION_SIMILARITY_NEIGHBOURS', 50)
+        
+        storage = user_similarity_storage()
+        
+        if touched_user_ids is not None:
+            # Изменения вносятся в активное поколение
+            _refresh_similarity_rows(
+                storage,
+                functools.partial(_cosine_similarity_pairs, features),
+                user_ids,
+                touched_user_ids,
+                neighbours
+            )
+            return
+        
+        # 4. Записи сохраняются в новое поколение, старое остается доступным для чтения
+        storage.start()
+        
+        # 5. Косинусное сходство считается блоками пользователей (только положительное сходство),
+        # пары каждого блока сразу передаются в хранилище. В режиме 'lsh' сходство
+        # считается только для пар-кандидатов, найденных по сигнатурам пользователей
+        if getattr(settings, 'RECOMMENDATION_USER_SIMILARITY_METHOD', 'exact') == 'lsh':
+            similarity_pairs = _approximate_cosine_similarity_pairs
+        else:
+            similarity_pairs = _cosine_similarity_pairs
+        
+        _write_similarity_pairs(storage, similarity_pairs(features, neighbours), user_ids)
+        
+        # 6. Переключаемся на новое поколение и удаляем старое
+        with instrumentation.phase('activate'):
+            storage.finish()
     
-    def update_track_similarities(self):
+    @instrumentation.phase('track_similarity')
+    def update_track_similarities(self, touched_track_ids=None):
         """
-        Обновить матрицу сходства между треками (item-based коллаборативная фильтрация)
+        Обновить матрицу сходства между треками (item-based коллаборативная фильтрация).
+        
+        Если передан touched_track_ids, пересчитывается только сходство этих
+        треков (см. _refresh_similarity_rows)
         """
-        # 1. Получаем все взаимодействия пользователей с треками
-        interactions = UserTrackInteraction.objects.filter(
-            interaction_type__in=['play', 'like']
-        ).values('user_id', 'track_id', 'interaction_type')
+        # 1. Признаки треков с достаточным количеством слушателей
+        track_ids, features = self.track_features(refit=touched_track_ids is None)
+        
+        # Если нет активных треков, завершаем
+        if len(track_ids) == 0:
+            return
+        
+        neighbours = getattr(settings, 'RECOMMENDATION_TRACK_SIMILARITY_NEIGHBOURS', None)
         
-        # 2. Преобразуем в DataFrame
-        df = pd.DataFrame(list(interactions))
+        storage = track_similarity_storage('collaborative')
         
-        # Если нет данных, завершаем
-        if df.empty:
+        if touched_track_ids is not None:
+            # Изменения вносятся в активное поколение
+            _refresh_similarity_rows(
+                storage,
+                functools.partial(_cosine_similarity_pairs, features),
+                track_ids,
+                touched_track_ids,
+                neighbours
+            )
             return
         
-        # 3. Создаем вес для взаимодействий (лайк имеет больший вес, чем прослушивание)
-        df['weight'] = df['interaction_type'].apply(lambda x: 2.0 if x == 'like' else 1.0)
+        # 2. Записи сохраняются в новое поколение, старое остается доступным для чтения
+        storage.start()
         
-        # 4. Создаем сводную таблицу: users x tracks
-        user_item_matrix = df.pivot_table(
-            index='user_id', 
-            columns='track_id', 
-            values='weight', 
-            aggfunc='sum', 
-            fill_value=0
-        )
+        # 3. Косинусное сходство считается блоками треков (только положительное сходство),
+        # пары каждого блока сразу передаются в хранилище
+        _write_similarity_pairs(storage, _cosine_similarity_pairs(features, neighbours), track_ids)
         
-        # 5. Фильтруем треки с недостаточным количеством взаимодействий
-        track_interaction_counts = user_item_matrix.astype(bool).sum(axis=0)
-        active_tracks = track_interaction_counts[track_interaction_counts >= self.MIN_INTERACTIONS].index
-        user_item_matrix = user_item_matrix[active_tracks]
+        # 4. Переключаемся на новое поколение и удаляем старое
+        with instrumentation.phase('activate'):
+            storage.finish()
+    
+    @instrumentation.phase('features')
+    def track_features(self, refit=True):
+        """
+        Признаки треков для коллаборативного сходства: строки матрицы треки x пользователи
+        (лайк имеет больший вес, чем прослушивание) для треков, у которых не меньше
+        MIN_INTERACTIONS слушателей. При включенном SVD строки проецируются в скрытое
+        пространство (при refit=False - сохраненной проекцией).
+        Возвращает массив ID треков и матрицу признаков
+        """
+        with instrumentation.phase('interactions') as phase:
+            matrix = interaction_matrix.build()
+            phase.rows += matrix.weights.nnz
+        track_matrix = matrix.weights.T.tocsr()
         
-        # Если нет активных треков, завершаем
-        if len(active_tracks) == 0:
-            return
+        # Фильтруем треки с недостаточным количеством слушателей
+        user_counts = np.diff(track_matrix.indptr)
+        active_rows = np.flatnonzero(user_counts >= self.MIN_INTERACTIONS)
         
-        # 6. Вычисляем матрицу косинусного сходства между треками
-        track_similarity = cosine_similarity(user_item_matrix.T)
+        track_ids = matrix.track_ids[active_rows]
+        if len(active_rows) == 0:
+            return track_ids, None
         
-        # 7. Создаем DataFrame сходства
-        track_similarity_df = pd.DataFrame(
-            track_similarity, 
-            index=active_tracks, 
-            columns=active_tracks
+        features = _similarity_features(
+            'track_collaborative', track_matrix[active_rows], matrix.user_ids, refit=refit
         )
+        return track_ids, features
+
+
+class MatrixFactorizationEngine:
+    """
+    Коллаборативная фильтрация на основе матричной факторизации неявной обратной связи (ALS).
+    
+    Матрица весов прослушиваний и лайков раскладывается на факторы пользователей
+    и треков размерности RECOMMENDATION_ALS_FACTORS. Вес взаимодействия задает
+    уверенность 1 + alpha * вес в том, что трек интересен пользователю.
+    Модель занимает (пользователи + треки) x факторы чисел float32 вместо
+    таблицы сходства всех пар пользователей, а оценка треков для пользователя -
+    одно умножение вектора факторов на матрицу факторов треков
+    """
+    
+    def __init__(self, factors=None, iterations=None, regularization=None, alpha=None, random_state=42):
+        self.factors = factors if factors is not None else getattr(settings, 'RECOMMENDATION_ALS_FACTORS', 32)
+        self.iterations = iterations if iterations is not None else getattr(settings, 'RECOMMENDATION_ALS_ITERATIONS', 15)
+        self.regularization = regularization if regularization is not None else getattr(settings, 'RECOMMENDATION_ALS_REGULARIZATION', 0.1)
+        self.alpha = alpha if alpha is not None else getattr(settings, 'RECOMMENDATION_ALS_ALPHA', 40.0)
+        self.random_state = random_state
+    
+    @instrumentation.phase('als_training')
+    def train(self):
+        """
+        Обучить модель на всех прослушиваниях и лайках и сохранить факторы на диск
+        """
+        matrix = interaction_matrix.build()
+        weights = matrix.weights
+        n_users, n_tracks = weights.shape
+        
+        rng = np.random.default_rng(self.random_state)
+        user_factors = rng.normal(scale=0.01, size=(n_users, self.factors))
+        track_factors = rng.normal(scale=0.01, size=(n_tracks, self.factors))
+        
+        # Поочередно решаем задачу наименьших квадратов для пользователей и для треков
+        track_weights = weights.T.tocsr()
+        for _ in range(self.iterations):
+            user_factors = self._least_squares(weights, track_factors)
+            track_factors = self._least_squares(track_weights, user_factors)
+        
+        model = FactorMatrixData(
+            user_factors.astype(np.float32),
+            track_factors.astype(np.float32),
+            matrix.user_ids,
+            matrix.track_ids
+        )
+        model.save()
+        factor_matrix.invalidate()
         
-        # 8. Подготавливаем данные для сохранения в базу
-        similarity_records = []
-        
-        # Очищаем старые записи
-        TrackSimilarity.objects.filter(similarity_type='collaborative').delete()
-        
-        # Создаем новые записи
-        for track_a in track_similarity_df.index:
-            for track_b in track_similarity_df.columns:
-                if track_a != track_b:  # Исключаем сходство трека с самим собой
-                    similarity = track_similarity_df.loc[track_a, track_b]
-                    if similarity > 0:  # Сохраняем только положительное сходство
-                        similarity_records.append(
-                            TrackSimilarity(
-                                track_a_id=track_a,
-                                track_b_id=track_b,
-                                similarity_score=similarity,
-                                similarity_type='collaborative'
-                            )
-                        )
-        
-        # 9. Сохраняем записи пакетами
-        if similarity_records:
-            batch_size = 1000
-            for i in range(0, len(similarity_records), batch_size):
-                TrackSimilarity.objects.bulk_create(
-                    similarity_records[i:i + batch_size]
-                )
+        return model
+    
+    def _least_squares(self, weights, fixed):
+        """
+        Шаг ALS: факторы строк матрицы weights при фиксированных факторах ее столбцов.
+        
+        Для строки u решается (Y^T C_u Y + λI) x_u = Y^T C_u p_u, где
+        Y^T C_u Y = Y^T Y + Y^T (C_u - I) Y: общая часть Y^T Y считается один раз,
+        а поправка - только по столбцам, с которыми у строки есть взаимодействия
+        """
+        n_factors = fixed.shape[1]
+        gram = fixed.T.dot(fixed) + self.regularization * np.eye(n_factors)
+        
+        result = np.zeros((weights.shape[0], n_factors))
+        for row in range(weights.shape[0]):
+            start, end = weights.indptr[row], weights.indptr[row + 1]
+            if start == end:
+                continue
+            
+            factors = fixed[weights.indices[start:end]]
+            confidence = 1.0 + self.alpha * weights.data[start:end]
+            
+            a = gram + (factors.T * (confidence - 1.0)).dot(factors)
+            b = factors.T.dot(confidence)
+            result[row] = np.linalg.solve(a, b)
+        
+        return result
+    
+    def get_recommendations(self, user_id, limit=20, exclude=()):
+        """
+        Рекомендации для пользователя, кроме треков из exclude.
+        Возвращает массивы ID треков и оценок, упорядоченные по убыванию оценки
+        """
+        exclude = np.fromiter(exclude, dtype=np.int64)
+        return self.score_users(
+            [user_id], limit, (np.zeros(len(exclude), dtype=np.intp), exclude)
+        )[0]
+    
+    def score_users(self, user_ids, limit=20, exclude=None):
+        """
+        Рекомендации для порции пользователей одним умножением матриц.
+        
+        exclude - пара массивов (номер пользователя в user_ids, ID трека) с треками,
+        которые не нужно рекомендовать. Возвращает список (track_ids, scores) для
+        каждого пользователя; оценки нормализованы от 0 до 1
+        """
+        model = factor_matrix.get()
+        if model is None or len(user_ids) == 0:
+            return [_empty_recommendations() for _ in user_ids]
+        
+        rows, found = model.user_rows(user_ids)
+        scores = np.zeros((len(user_ids), len(model.track_ids)))
+        scores[found] = model.user_factors[rows[found]].dot(model.track_factors.T)
+        
+        if exclude is not None:
+            positions, track_ids = exclude
+            columns, known = model.track_columns(track_ids)
+            scores[np.asarray(positions)[known], columns[known]] = 0.0
+        
+        top = _top_k_rows(scores, limit)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        row_max = scores.max(axis=1) if scores.shape[1] else np.zeros(len(user_ids))
+        
+        result = []
+        for idx in range(len(user_ids)):
+            valid = top_scores[idx] > 0
+            result.append((
+                model.track_ids[top[idx][valid]],
+                top_scores[idx][valid] / row_max[idx] if valid.any() else top_scores[idx][valid]
+            ))
+        return result
 
 
 class ContentBasedFilteringEngine:
@@ -496,53 +1472,70 @@ class ContentBasedFilteringEngine:
     Движок контентной фильтрации для обновления сходства между треками на основе их содержания
     """
     
-    def update_track_content_similarities(self):
+    @instrumentation.phase('content_similarity')
+    def update_track_content_similarities(self, refit=True):
         """
-        Обновить матрицу сходства между треками на основе их содержания (жанров и аудио-характеристик)
+        Обновить матрицу сходства между треками на основе их содержания (жанров и аудио-характеристик).
+        При refit=False признаки проецируются сохраненной проекцией SVD (см. track_features)
         """
-        # 1. Получаем все треки с их жанрами
-        tracks = Track.objects.filter(is_published=True).prefetch_related('genres')
+        # 1. Признаки опубликованных треков
+        track_ids, combined_matrix = self.track_features(refit=refit)
         
-        if not tracks:
+        if len(track_ids) == 0:
             return
         
-        # 2. Создаем DataFrame жанров для треков (one-hot encoding)
-        genres = Genre.objects.all()
-        genre_map = {genre.id: idx for idx, genre in enumerate(genres)}
-        
-        # Создаем матрицу треков и жанров
-        track_genre_matrix = np.zeros((len(tracks), len(genres)))
-        track_ids = []
+        # 2. Записи сохраняются в новое поколение, старое остается доступным для чтения
+        storage = track_similarity_storage('content_based')
+        storage.start()
         
-        for idx, track in enumerate(tracks):
-            track_ids.append(track.id)
-            for genre in track.genres.all():
-                if genre.id in genre_map:
-                    track_genre_matrix[idx, genre_map[genre.id]] = 1
+        # 3. Косинусное сходство считается блоками треков (только положительное сходство),
+        # пары каждого блока сразу передаются в хранилище
+        _write_similarity_pairs(storage, _cosine_similarity_pairs(combined_matrix), track_ids)
         
-        # 3. Добавляем аудио-характеристики, если они есть
-        audio_features = []
-        audio_feature_names = set()
+        # 4. Переключаемся на новое поколение и удаляем старое
+        with instrumentation.phase('activate'):
+            storage.finish()
+    
+    @instrumentation.phase('features')
+    def track_features(self, refit=True):
+        """
+        Признаки опубликованных треков для контентного сходства: жанры (one-hot)
+        и нормализованные аудио-характеристики. При включенном SVD строки
+        проецируются в скрытое пространство (при refit=False - сохраненной
+        проекцией, чтобы пересчитанные строки были сравнимы с сохраненными).
+        Возвращает массив ID треков и матрицу признаков
+        """
+        # 1. ID опубликованных треков (одним запросом, без объектов моделей)
+        track_ids = np.fromiter(
+            Track.objects.filter(is_published=True).order_by('id').values_list('id', flat=True),
+            dtype=np.int64
+        )
         
-        for track in tracks:
-            if track.audio_features:
-                for feature_name in track.audio_features.keys():
-                    audio_feature_names.add(feature_name)
+        if len(track_ids) == 0:
+            return track_ids, None
+        
+        # 2. Матрица жанров (one-hot) строится по промежуточной таблице связи треков
+        # и жанров, из нее выбираются строки опубликованных треков (у треков без жанров - нулевые)
+        genres = track_genre_matrix.build()
+        genre_rows, genre_found = genres.track_rows(track_ids)
+        selection = sparse.csr_matrix(
+            (
+                np.ones(int(genre_found.sum())),
+                (np.flatnonzero(genre_found), genre_rows[genre_found])
+            ),
+            shape=(len(track_ids), len(genres.track_ids))
+        )
+        genre_matrix = selection.dot(genres.binary).tocsr()
         
-        audio_feature_names = sorted(audio_feature_names)
-        audio_feature_map = {name: idx for idx, name in enumerate(audio_feature_names)}
+        # 3. Добавляем аудио-характеристики из хранилища (матрица отображается в память;
+        # хранилище сверяется с базой и при расхождении перестраивается)
+        audio = audio_feature_store.load(verify=True)
+        audio_feature_names = list(audio.feature_names)
         
         if audio_feature_names:
-            audio_feature_matrix = np.zeros((len(tracks), len(audio_feature_names)))
-            
-            for idx, track in enumerate(tracks):
-                if track.audio_features:
-                    for feature_name, value in track.audio_features.items():
-                        if feature_name in audio_feature_map:
-                            try:
-                                audio_feature_matrix[idx, audio_feature_map[feature_name]] = float(value)
-                            except (ValueError, TypeError):
-                                pass
+            audio_rows, audio_found = audio.track_rows(track_ids)
+            audio_feature_matrix = np.zeros((len(track_ids), len(audio_feature_names)))
+            audio_feature_matrix[audio_found] = audio.matrix[audio_rows[audio_found]]
             
             # Нормализуем аудио-характеристики
             feature_max = np.max(audio_feature_matrix, axis=0)
@@ -550,45 +1543,159 @@ class ContentBasedFilteringEngine:
             audio_feature_matrix = audio_feature_matrix / feature_max
             
             # Объединяем матрицы жанров и аудио-характеристик
-            combined_matrix = np.hstack((track_genre_matrix, audio_feature_matrix))
+            combined_matrix = sparse.hstack((genre_matrix, sparse.csr_matrix(audio_feature_matrix))).tocsr()
         else:
-            combined_matrix = track_genre_matrix
+            combined_matrix = genre_matrix
         
-        # 4. Вычисляем матрицу косинусного сходства между треками
-        track_similarity = cosine_similarity(combined_matrix)
+        # При включенном SVD сходство считается в скрытом пространстве
+        column_ids = [f'genre:{genre_id}' for genre_id in genres.genre_ids.tolist()] + [
+            f'audio:{name}' for name in audio_feature_names
+        ]
+        combined_matrix = _similarity_features('track_content', combined_matrix, column_ids, refit=refit)
         
-        # 5. Создаем DataFrame сходства
-        track_similarity_df = pd.DataFrame(
-            track_similarity, 
-            index=track_ids, 
-            columns=track_ids
+        return track_ids, combined_matrix
+
+
+class HybridFilteringEngine:
+    """
+    Движок сходства треков всех типов: коллаборативное, контентное и гибридное
+    (взвешенная сумма коллаборативного и контентного) сходство
+    """
+    
+    def update_track_similarities(self, touched_track_ids=None):
+        """
+        Обновить сходство треков всех типов.
+        
+        При полном пересчете все три типа сходства считаются в одном проходе по
+        блокам треков (см. _update_all_track_similarities). Если передан
+        touched_track_ids (инкрементальный режим), коллаборативное и гибридное
+        сходство пересчитываются только для этих треков (см. _refresh_similarity_rows),
+        а контентное, не зависящее от взаимодействий, пересчитывается полностью.
+        В инкрементальном режиме признаки проецируются сохраненными проекциями SVD
+        (новая проекция рассчитывается только при полном пересчете). Изменения
+        признаков содержания попадают в гибридное сходство при следующем полном
+        пересчете
+        """
+        if touched_track_ids is None:
+            self._update_all_track_similarities()
+            return
+        
+        CollaborativeFilteringEngine().update_track_similarities(touched_track_ids)
+        ContentBasedFilteringEngine().update_track_content_similarities(refit=False)
+        self._refresh_hybrid_similarities(touched_track_ids)
+    
+    @instrumentation.phase('features')
+    def track_features(self, refit=True):
+        """
+        Признаки треков для всех типов сходства с общими строками: объединение
+        опубликованных треков и треков с достаточным количеством слушателей.
+        У трека без признаков одного из типов соответствующая строка нулевая.
+        Возвращает массив ID треков, коллаборативные и контентные признаки
+        (None, если таких треков нет) и маску опубликованных треков
+        """
+        content_ids, content_features = ContentBasedFilteringEngine().track_features(refit=refit)
+        collaborative_ids, collaborative_features = CollaborativeFilteringEngine().track_features(refit=refit)
+        
+        track_ids = np.union1d(content_ids, collaborative_ids)
+        is_published = np.isin(track_ids, content_ids)
+        
+        def rows_of(features, feature_ids):
+            if len(feature_ids) == 0:
+                return None
+            selection = sparse.csr_matrix(
+                (np.ones(len(feature_ids)), (np.searchsorted(track_ids, feature_ids), np.arange(len(feature_ids)))),
+                shape=(len(track_ids), len(feature_ids))
+            )
+            return selection.dot(features)
+        
+        return (
+            track_ids,
+            rows_of(collaborative_features, collaborative_ids),
+            rows_of(content_features, content_ids),
+            is_published,
         )
+    
+    @staticmethod
+    def _similarity_inputs(collaborative, content):
+        """
+        Матрицы признаков (коллаборативные, контентные - те, что есть)
+        и их веса в гибридном сходстве
+        """
+        matrices, weights = [], []
+        if collaborative is not None:
+            matrices.append(collaborative)
+            weights.append(getattr(settings, 'RECOMMENDATION_HYBRID_COLLABORATIVE_WEIGHT', 0.5))
+        if content is not None:
+            matrices.append(content)
+            weights.append(getattr(settings, 'RECOMMENDATION_HYBRID_CONTENT_WEIGHT', 0.5))
+        return matrices, weights
+    
+    @instrumentation.phase('track_similarity')
+    def _update_all_track_similarities(self):
+        """
+        Полный пересчет сходства треков в одном проходе.
         
-        # 6. Подготавливаем данные для сохранения в базу
-        similarity_records = []
-        
-        # Очищаем старые записи
-        TrackSimilarity.objects.filter(similarity_type='content_based').delete()
-        
-        # Создаем новые записи
-        for track_a in track_ids:
-            for track_b in track_ids:
-                if track_a != track_b:  # Исключаем сходство трека с самим собой
-                    similarity = track_similarity_df.loc[track_a, track_b]
-                    if similarity > 0:  # Сохраняем только положительное сходство
-                        similarity_records.append(
-                            TrackSimilarity(
-                                track_a_id=track_a,
-                                track_b_id=track_b,
-                                similarity_score=similarity,
-                                similarity_type='content_based'
-                            )
-                        )
-        
-        # 7. Сохраняем записи пакетами
-        if similarity_records:
-            batch_size = 1000
-            for i in range(0, len(similarity_records), batch_size):
-                TrackSimilarity.objects.bulk_create(
-                    similarity_records[i:i + batch_size]
-                )
\ No newline at end of file
+        Для каждого блока треков коллаборативное и контентное сходство считаются
+        один раз; из них же сразу выбираются пары коллаборативного и контентного
+        сходства и смешиваются гибридные (веса RECOMMENDATION_HYBRID_COLLABORATIVE_WEIGHT
+        и RECOMMENDATION_HYBRID_CONTENT_WEIGHT, для каждого опубликованного трека -
+        RECOMMENDATION_HYBRID_NEIGHBOURS самых похожих опубликованных треков)
+        """
+        # 1. Признаки треков с общими строками
+        track_ids, collaborative, content, is_published = self.track_features()
+        
+        if len(track_ids) == 0:
+            return
+        
+        # 2. Типы сходства, которые считаются в этом проходе
+        matrices, weights = self._similarity_inputs(collaborative, content)
+        neighbours, storages = [], []
+        if collaborative is not None:
+            neighbours.append(getattr(settings, 'RECOMMENDATION_TRACK_SIMILARITY_NEIGHBOURS', None))
+            storages.append(track_similarity_storage('collaborative'))
+        if content is not None:
+            neighbours.append(None)
+            storages.append(track_similarity_storage('content_based'))
+            # Гибридное сходство смешивается из тех же блоков
+            hybrid_neighbours = getattr(settings, 'RECOMMENDATION_HYBRID_NEIGHBOURS', 20)
+            storages.append(track_similarity_storage('hybrid'))
+        
+        def blocks():
+            extra_blocks = 2 if content is not None else 0
+            for block_rows, similarity in _similarity_blocks(matrices, extra_blocks=extra_blocks):
+                selected = [_select_pairs(block, k) for block, k in zip(similarity, neighbours)]
+                if content is not None:
+                    hybrid = _blend_blocks(similarity, weights, block_rows, is_published)
+                    selected.append(_select_pairs(hybrid, hybrid_neighbours))
+                yield [(block_rows[rows], columns, scores) for rows, columns, scores in selected]
+        
+        # 3. Записи сохраняются в новые поколения, старые остаются доступными для чтения
+        for storage in storages:
+            storage.start()
+        
+        # 4. Пары каждого блока сразу передаются в хранилища
+        _write_similarity_outputs(storages, blocks(), track_ids)
+        
+        # 5. Переключаемся на новые поколения и удаляем старые
+        with instrumentation.phase('activate'):
+            for storage in storages:
+                storage.finish()
+    
+    @instrumentation.phase('hybrid_similarity')
+    def _refresh_hybrid_similarities(self, touched_track_ids):
+        """
+        Пересчитать гибридное сходство треков с новыми взаимодействиями
+        """
+        track_ids, collaborative, content, is_published = self.track_features(refit=False)
+        
+        if content is None:
+            return
+        
+        matrices, weights = self._similarity_inputs(collaborative, content)
+        _refresh_similarity_rows(
+            track_similarity_storage('hybrid'),
+            functools.partial(_hybrid_similarity_pairs, matrices, weights, mask=is_published),
+            track_ids,
+            touched_track_ids,
+            getattr(settings, 'RECOMMENDATION_HYBRID_NEIGHBOURS', 20)
+        )
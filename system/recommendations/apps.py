@@ -0,0 +1,11 @@
+# recommendations/apps.py
+
+from django.apps import AppConfig
+
+
+class RecommendationsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'recommendations'
+    
+    def ready(self):
+        import recommendations.signals
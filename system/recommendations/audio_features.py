@@ -0,0 +1,311 @@
+# recommendations/audio_features.py
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from tracks.models import Track
+from .matrices import lookup_ids
+from .versions import create_version, publish_version, read_version, write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def _feature_value(value):
+    """
+    Значение аудио-характеристики как число (нечисловые значения считаются нулем)
+    """
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+class AudioFeatureData:
+    """
+    Аудио-характеристики треков: плотная матрица float32 треки x характеристики
+    """
+
+    def __init__(self, matrix, track_ids, feature_names):
+        self.matrix = matrix
+        self.track_ids = track_ids  # ID треков (строки); новые треки дописываются в конец
+        self.feature_names = feature_names  # Названия характеристик (столбцы)
+
+        # Дописанные треки могут нарушить порядок ID - тогда поиск идет по отсортированной копии
+        if np.all(track_ids[1:] > track_ids[:-1]):
+            self._order = None
+            self._sorted_ids = track_ids
+        else:
+            self._order = np.argsort(track_ids, kind='stable')
+            self._sorted_ids = np.asarray(track_ids)[self._order]
+
+    def track_rows(self, track_ids):
+        """
+        Номера строк треков и маска найденных треков
+        """
+        positions, found = lookup_ids(self._sorted_ids, track_ids)
+        if self._order is not None:
+            positions = self._order[positions]
+        return positions, found
+
+
+class AudioFeatureStore:
+    """
+    Хранилище аудио-характеристик треков на диске (RECOMMENDATION_DATA_DIR/audio_features).
+
+    Версия хранилища - каталог с матрицей matrix.npy и ID треков track_ids.npy,
+    выделенными с запасом строк, схемой столбцов schema.json и количеством
+    заполненных строк в файле ROWS; файл CURRENT указывает на актуальную версию.
+    Характеристики уже известного трека перезаписываются на месте, новый трек
+    дописывается в следующую свободную строку, после чего атомарно заменяется
+    ROWS. Новая версия (с атомарным переключением CURRENT) записывается, только
+    когда заканчивается запас строк (запас удваивается), появляется новая
+    характеристика или у трека удаляются характеристики. Треки с пустым
+    словарем характеристик хранятся нулевыми строками.
+
+    Хранилище обновляется сигналом при сохранении трека. Изменения в обход
+    сигналов (queryset.update) не отслеживаются: при чтении с verify=True
+    количество треков и наибольший ID сверяются с базой, и при расхождении
+    хранилище перестраивается; после массового изменения характеристик через
+    update следует вызвать rebuild()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._state = None
+
+    @staticmethod
+    def directory():
+        return os.path.join(
+            getattr(settings, 'RECOMMENDATION_DATA_DIR', 'recommendation_data'), 'audio_features'
+        )
+
+    def _read_rows(self, version):
+        with open(os.path.join(self.directory(), version, 'ROWS')) as rows:
+            return int(rows.read())
+
+    def _write_rows(self, version, rows):
+        write_atomic(os.path.join(self.directory(), version, 'ROWS'), str(rows))
+
+    def _open(self, version, mode):
+        """
+        Матрица и ID треков версии целиком (вместе с запасом строк),
+        названия характеристик и количество заполненных строк
+        """
+        version_directory = os.path.join(self.directory(), version)
+        with open(os.path.join(version_directory, 'schema.json'), encoding='utf-8') as schema:
+            feature_names = json.load(schema)['features']
+        rows = self._read_rows(version)
+        return (
+            np.load(os.path.join(version_directory, 'matrix.npy'), mmap_mode=mode),
+            np.load(os.path.join(version_directory, 'track_ids.npy'), mmap_mode=mode),
+            feature_names,
+            rows,
+        )
+
+    def _write(self, matrix, track_ids, feature_names, capacity=None):
+        """
+        Записать новую версию хранилища (с запасом строк до capacity) и переключиться на нее
+        """
+        rows = len(track_ids)
+        capacity = max(capacity or 2 * rows, rows, 1024)
+
+        os.makedirs(self.directory(), exist_ok=True)
+        version, version_directory = create_version(self.directory())
+
+        stored_matrix = np.lib.format.open_memmap(
+            os.path.join(version_directory, 'matrix.npy'), mode='w+',
+            dtype=np.float32, shape=(capacity, len(feature_names))
+        )
+        stored_matrix[:rows] = matrix
+        stored_matrix.flush()
+        stored_ids = np.lib.format.open_memmap(
+            os.path.join(version_directory, 'track_ids.npy'), mode='w+',
+            dtype=np.int64, shape=(capacity,)
+        )
+        stored_ids[:rows] = track_ids
+        stored_ids.flush()
+        del stored_matrix, stored_ids
+
+        with open(os.path.join(version_directory, 'schema.json'), 'w', encoding='utf-8') as schema:
+            json.dump({'features': list(feature_names)}, schema, ensure_ascii=False)
+        self._write_rows(version, rows)
+
+        publish_version(self.directory(), version)
+
+    def _exclusive(self):
+        """
+        Блокировка записи между процессами (файл блокировки в каталоге хранилища)
+        """
+        os.makedirs(self.directory(), exist_ok=True)
+        return _FileLock(os.path.join(self.directory(), 'LOCK'))
+
+    def load(self, verify=False):
+        """
+        Получить актуальные аудио-характеристики (файлы отображаются в память).
+        Если хранилище еще не создано, оно строится по базе данных.
+        verify=True сверяет хранилище с базой (один запрос) и перестраивает его при расхождении
+        """
+        version = read_version(self.directory())
+        if version is None:
+            self.rebuild()
+            return self.load()
+
+        try:
+            state = (version, self._read_rows(version))
+            if self._data is None or self._state != state:
+                with self._lock:
+                    if self._data is None or self._state != state:
+                        matrix, track_ids, feature_names, rows = self._open(version, 'r')
+                        self._data = AudioFeatureData(matrix[:rows], track_ids[:rows], feature_names)
+                        self._state = state
+        except FileNotFoundError:
+            # Версию только что заменили - читаем новую. Если CURRENT не менялся,
+            # версия неполная (например, записана прежним форматом) - перестраиваем ее
+            if read_version(self.directory()) == version:
+                self.rebuild()
+            return self.load(verify)
+
+        data = self._data
+        if verify and self._is_stale(data):
+            self.rebuild()
+            return self.load()
+        return data
+
+    def _is_stale(self, data):
+        """
+        Расходится ли хранилище с базой по количеству треков с характеристиками и наибольшему ID
+        """
+        state = Track.objects.exclude(audio_features__isnull=True).aggregate(
+            count=Count('id'), last_id=Max('id')
+        )
+        last_id = int(data.track_ids.max()) if len(data.track_ids) else None
+        return state['count'] != len(data.track_ids) or state['last_id'] != last_id
+
+    def rebuild(self):
+        """
+        Построить хранилище заново по аудио-характеристикам треков в базе данных
+        """
+        matrix, track_ids, feature_names = self._from_database()
+        with self._exclusive():
+            self._write(matrix, track_ids, feature_names)
+
+    def update(self, track_id, features):
+        """
+        Записать аудио-характеристики одного трека. Трек с пустым словарем
+        характеристик хранится нулевой строкой (как и при построении по базе),
+        трек без характеристик (None) удаляется из хранилища
+        """
+        with self._exclusive():
+            version = read_version(self.directory())
+            if version is None:
+                # Хранилища еще нет: строим его целиком (в базе уже есть новые характеристики)
+                self._write(*self._from_database())
+                return
+
+            try:
+                matrix, track_ids, feature_names, rows = self._open(version, 'r+')
+            except FileNotFoundError:
+                # Неполная версия: строим хранилище заново
+                self._write(*self._from_database())
+                return
+
+            matches = np.flatnonzero(track_ids[:rows] == track_id)
+            if features is None:
+                if len(matches):
+                    # Характеристики трека удалены: записываем новую версию без его строки
+                    keep = np.ones(rows, dtype=bool)
+                    keep[matches] = False
+                    new_matrix = np.array(matrix[:rows][keep])
+                    new_ids = np.array(track_ids[:rows][keep])
+                    del matrix, track_ids
+                    self._write(new_matrix, new_ids, feature_names)
+                return
+
+            new_features = sorted(name for name in features if name not in feature_names)
+            if new_features or (len(matches) == 0 and rows == len(track_ids)):
+                # Новые характеристики или закончился запас строк: записываем новую версию
+                names = list(feature_names) + new_features
+                new_matrix = np.zeros((rows, len(names)), dtype=np.float32)
+                new_matrix[:, :len(feature_names)] = matrix[:rows]
+                new_ids = np.array(track_ids[:rows])
+                if len(matches) == 0:
+                    new_matrix = np.vstack([new_matrix, np.zeros((1, len(names)), dtype=np.float32)])
+                    new_ids = np.append(new_ids, track_id)
+                    row = rows
+                else:
+                    row = int(matches[0])
+                new_matrix[row] = self._row(features, names)
+                del matrix, track_ids
+                self._write(new_matrix, new_ids, names, capacity=2 * len(new_ids))
+                return
+
+            if len(matches):
+                # Перезаписываем строку трека на месте
+                matrix[matches[0]] = self._row(features, feature_names)
+                matrix.flush()
+                return
+
+            # Дописываем трек в следующую свободную строку и публикуем новое количество строк
+            matrix[rows] = self._row(features, feature_names)
+            track_ids[rows] = track_id
+            matrix.flush()
+            track_ids.flush()
+            self._write_rows(version, rows + 1)
+
+    @staticmethod
+    def _row(features, feature_names):
+        """
+        Строка матрицы по словарю характеристик трека
+        """
+        columns = {name: idx for idx, name in enumerate(feature_names)}
+        row = np.zeros(len(feature_names), dtype=np.float32)
+        for name, value in features.items():
+            row[columns[name]] = _feature_value(value)
+        return row
+
+    def _from_database(self):
+        """
+        Матрица, ID треков и названия характеристик по данным базы (один запрос без объектов моделей)
+        """
+        rows = list(Track.objects.exclude(audio_features__isnull=True).order_by('id').values_list('id', 'audio_features'))
+
+        feature_names = sorted({name for _, features in rows if features for name in features})
+        columns = {name: idx for idx, name in enumerate(feature_names)}
+
+        matrix = np.zeros((len(rows), len(feature_names)), dtype=np.float32)
+        for idx, (_, features) in enumerate(rows):
+            for name, value in (features or {}).items():
+                matrix[idx, columns[name]] = _feature_value(value)
+
+        return matrix, [track_id for track_id, _ in rows], feature_names
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+# Хранилище аудио-характеристик, общее для процесса
+audio_feature_store = AudioFeatureStore()
@@ -0,0 +1,137 @@
+# recommendations/cache.py
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Max
+
+from tracks.models import UserTrackInteraction
+from .generations import get_active_generation
+from .matrices import INTERACTION_WEIGHTS
+from .models import SimilarityGeneration
+
+
+# Название счетчика пересчетов сходства в таблице SimilarityGeneration
+SIMILARITY_GENERATION_NAME = 'recommendations'
+
+
+def get_similarity_generation():
+    """
+    Текущее поколение сходства для кэша рекомендаций (увеличивается после каждого пересчета).
+    Хранится в базе, поэтому одинаково для всех процессов
+    """
+    return get_active_generation(SIMILARITY_GENERATION_NAME)
+
+
+def bump_similarity_generation():
+    """
+    Отметить, что таблицы сходства пересчитаны. Все закэшированные рекомендации устаревают
+    """
+    updated = SimilarityGeneration.objects.filter(
+        name=SIMILARITY_GENERATION_NAME
+    ).update(generation=F('generation') + 1)
+    if not updated:
+        SimilarityGeneration.objects.get_or_create(
+            name=SIMILARITY_GENERATION_NAME,
+            defaults={'generation': 1}
+        )
+    return get_similarity_generation()
+
+
+def get_last_interaction_id(user_id):
+    """
+    ID последнего взаимодействия пользователя, учитываемого в рекомендациях
+    """
+    return UserTrackInteraction.objects.filter(
+        user_id=user_id,
+        interaction_type__in=list(INTERACTION_WEIGHTS)
+    ).aggregate(last_id=Max('id'))['last_id']
+
+
+class RecommendationCache:
+    """
+    Кэш итоговых списков рекомендаций пользователей.
+
+    Запись хранит ID треков, оценки и источники, а также отметки, по которым
+    при чтении проверяется ее актуальность: ID последнего взаимодействия
+    пользователя и поколение сходства. Обе отметки читаются из базы, поэтому
+    запись устаревает во всех процессах, даже если взаимодействие добавлено
+    без сигналов (queryset.update, bulk_create).
+
+    Изменение предпочтений пользователя удаляет запись сигналом (см.
+    recommendations/signals.py); это действует во всех процессах только с общим
+    для процессов бэкендом кэша (CACHES, например Redis или Memcached).
+    С локальным кэшем процесса (LocMemCache, по умолчанию) другие процессы
+    увидят новые предпочтения после RECOMMENDATION_CACHE_TIMEOUT
+    """
+    key_prefix = 'recommendations:user'
+    hits_key = 'recommendations:cache:hits'
+    misses_key = 'recommendations:cache:misses'
+
+    def _key(self, user_id):
+        return f'{self.key_prefix}:{user_id}'
+
+    def _count(self, key):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def get(self, user_id, limit):
+        """
+        Получить закэшированные рекомендации: список (track_id, score, sources) или None
+        """
+        entry = cache.get(self._key(user_id))
+
+        if (
+            entry is None
+            or entry['limit'] < limit
+            or entry['generation'] != get_similarity_generation()
+            or entry['last_interaction_id'] != get_last_interaction_id(user_id)
+        ):
+            self._count(self.misses_key)
+            return None
+
+        self._count(self.hits_key)
+        return entry['items'][:limit]
+
+    def set(self, user_id, limit, items, last_interaction_id):
+        """
+        Сохранить рекомендации пользователя в кэш
+        """
+        entry = {
+            'limit': limit,
+            'items': items,
+            'last_interaction_id': last_interaction_id,
+            'generation': get_similarity_generation(),
+        }
+        timeout = getattr(settings, 'RECOMMENDATION_CACHE_TIMEOUT', 900)
+        cache.set(self._key(user_id), entry, timeout)
+
+    def invalidate(self, user_id):
+        """
+        Удалить рекомендации пользователя из кэша
+        """
+        cache.delete(self._key(user_id))
+
+    def invalidate_many(self, user_ids):
+        """
+        Удалить рекомендации нескольких пользователей из кэша
+        """
+        cache.delete_many([self._key(user_id) for user_id in user_ids])
+
+    def stats(self):
+        """
+        Счетчики попаданий и промахов кэша
+        """
+        hits = cache.get(self.hits_key, 0)
+        misses = cache.get(self.misses_key, 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+        }
+
+
+# Общий кэш рекомендаций
+recommendation_cache = RecommendationCache()
@@ -0,0 +1,74 @@
+# recommendations/generations.py
+
+from django.db.models import Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import SimilarityGeneration, TrackSimilarity
+
+
+# Название поколений таблицы сходства пользователей
+USER_SIMILARITY = 'user_similarity'
+
+
+def track_similarity_name(similarity_type):
+    """
+    Название поколений таблицы сходства треков заданного типа
+    """
+    return f'track_similarity:{similarity_type}'
+
+
+def get_active_generation(name):
+    """
+    Номер активного поколения (0, если сходство еще не пересчитывалось)
+    """
+    generation = SimilarityGeneration.objects.filter(
+        name=name
+    ).values_list('generation', flat=True).first()
+    return generation or 0
+
+
+def active_generation(name):
+    """
+    Подзапрос с номером активного поколения.
+    Используется в фильтрах, чтобы поколение читалось в том же запросе, что и записи
+    """
+    return Coalesce(
+        Subquery(SimilarityGeneration.objects.filter(name=name).values('generation')[:1]),
+        Value(0)
+    )
+
+
+def active_track_similarities():
+    """
+    Условие для записей TrackSimilarity из активных поколений всех типов сходства
+    """
+    condition = Q()
+    for similarity_type, _ in TrackSimilarity._meta.get_field('similarity_type').choices:
+        condition |= Q(
+            similarity_type=similarity_type,
+            generation=active_generation(track_similarity_name(similarity_type))
+        )
+    return condition
+
+
+def start_generation(name, queryset):
+    """
+    Начать запись нового поколения сходства.
+    
+    Удаляет записи поколений, запись которых не была завершена.
+    Возвращает номер нового поколения
+    """
+    generation = get_active_generation(name) + 1
+    queryset.filter(generation__gte=generation).delete()
+    return generation
+
+
+def activate_generation(name, generation, queryset):
+    """
+    Сделать поколение активным и удалить записи предыдущих поколений
+    """
+    SimilarityGeneration.objects.update_or_create(
+        name=name,
+        defaults={'generation': generation}
+    )
+    queryset.filter(generation__lt=generation).delete()
@@ -0,0 +1,85 @@
+# recommendations/impressions.py
+
+import atexit
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import UserTrackRecommendation
+
+
+def mark_recommendations_shown(user_id, track_ids):
+    """
+    Пометить рекомендации пользователя как показанные одним запросом UPDATE.
+    Возвращает количество обновленных записей
+    """
+    return UserTrackRecommendation.objects.filter(
+        user_id=user_id,
+        track_id__in=track_ids,
+        is_shown=False
+    ).update(is_shown=True)
+
+
+class ImpressionBuffer:
+    """
+    Буфер показов рекомендаций с отложенной записью.
+
+    Показы накапливаются в памяти процесса и записываются в базу пакетами:
+    когда в буфере набирается RECOMMENDATION_IMPRESSION_BATCH_SIZE треков или
+    с последней записи прошло RECOMMENDATION_IMPRESSION_FLUSH_INTERVAL секунд.
+    При завершении процесса буфер сбрасывается в базу
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(set)  # {user_id: {track_id, ...}}
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, user_id, track_ids):
+        """
+        Добавить показы в буфер
+        """
+        batch_size = getattr(settings, 'RECOMMENDATION_IMPRESSION_BATCH_SIZE', 500)
+        interval = getattr(settings, 'RECOMMENDATION_IMPRESSION_FLUSH_INTERVAL', 5)
+
+        with self._lock:
+            pending = self._pending[user_id]
+            before = len(pending)
+            pending.update(track_ids)
+            self._size += len(pending) - before
+
+            should_flush = (
+                self._size >= batch_size
+                or time.monotonic() - self._last_flush >= interval
+            )
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Записать накопленные показы в базу
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = defaultdict(set)
+            self._size = 0
+            self._last_flush = time.monotonic()
+
+        if not pending:
+            return 0
+
+        updated = 0
+        with transaction.atomic():
+            for user_id, track_ids in pending.items():
+                updated += mark_recommendations_shown(user_id, track_ids)
+        return updated
+
+
+# Общий буфер показов для процесса
+impression_buffer = ImpressionBuffer()
+atexit.register(impression_buffer.flush)
@@ -0,0 +1,196 @@
+# recommendations/instrumentation.py
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connection
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss():
+    """
+    Пиковый объем резидентной памяти процесса в байтах (None, если недоступно)
+    """
+    if resource is None:
+        return None
+    # На Linux ru_maxrss задается в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Phase:
+    """
+    Текущее выполнение этапа: код этапа отмечает в нем количество обработанных строк
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.peak_memory = 0
+
+
+class PhaseStats:
+    """
+    Накопленная статистика этапа по всем его выполнениям
+    """
+
+    def __init__(self, path):
+        self.path = path  # Названия этапа и родительских этапов
+        self.calls = 0
+        self.wall_time = 0.0
+        self.rows = 0
+        self.queries = 0
+        self.peak_memory = None  # Пик памяти Python (tracemalloc), байт
+        self.peak_rss = None  # Пиковый RSS процесса на конец этапа, байт
+
+    def as_dict(self):
+        return {
+            'phase': '/'.join(self.path),
+            'calls': self.calls,
+            'wall_time': round(self.wall_time, 6),
+            'rows': self.rows,
+            'queries': self.queries,
+            'peak_memory': self.peak_memory,
+            'peak_rss': self.peak_rss,
+        }
+
+
+class Instrumentation:
+    """
+    Замер этапов расчета сходства и рекомендаций: время, количество строк,
+    пик памяти (tracemalloc и RSS) и количество SQL-запросов.
+
+    Пока замер не запущен (start), этапы не записываются и почти ничего не стоят.
+    Вложенные этапы записываются под путем родительского этапа
+    """
+
+    def __init__(self):
+        self.active = False
+        self.stats = {}
+        self._stack = []
+        self._queries = 0
+        self._trace_memory = False
+        self._started_tracing = False
+
+    def _count_query(self, execute, sql, params, many, context):
+        self._queries += 1
+        return execute(sql, params, many, context)
+
+    def start(self, trace_memory=True):
+        """
+        Начать замер. trace_memory=True включает tracemalloc (замедляет расчет)
+        """
+        if self.active:
+            return
+        self.active = True
+        self.stats = {}
+        self._queries = 0
+        self._trace_memory = trace_memory
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        connection.execute_wrappers.append(self._count_query)
+
+    def stop(self):
+        """
+        Завершить замер (накопленная статистика сохраняется)
+        """
+        if not self.active:
+            return
+        self.active = False
+        if self._count_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self._count_query)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Замерить этап:
+
+            with instrumentation.phase('user_similarity') as phase:
+                ...
+                phase.rows += len(rows)
+        """
+        phase = Phase()
+        if not self.active:
+            yield phase
+            return
+
+        tracing = self._trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # Пик родительского этапа до начала вложенного
+            if self._stack:
+                parent = self._stack[-1][0]
+                parent.peak_memory = max(parent.peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        # Статистика создается при первом запуске, чтобы родительские этапы шли в отчете раньше вложенных
+        path = (self._stack[-1][1] if self._stack else ()) + (name,)
+        stats = self.stats.get(path)
+        if stats is None:
+            stats = self.stats[path] = PhaseStats(path)
+        self._stack.append((phase, path))
+
+        start_time = time.perf_counter()
+        start_queries = self._queries
+        try:
+            yield phase
+        finally:
+            self._stack.pop()
+            stats.calls += 1
+            stats.wall_time += time.perf_counter() - start_time
+            stats.rows += phase.rows
+            stats.queries += self._queries - start_queries
+
+            if tracing:
+                phase.peak_memory = max(phase.peak_memory, tracemalloc.get_traced_memory()[1])
+                stats.peak_memory = max(stats.peak_memory or 0, phase.peak_memory)
+                if self._stack:
+                    parent = self._stack[-1][0]
+                    parent.peak_memory = max(parent.peak_memory, phase.peak_memory)
+
+            peak_rss = _peak_rss()
+            if peak_rss is not None:
+                stats.peak_rss = max(stats.peak_rss or 0, peak_rss)
+
+    def report(self):
+        """
+        Статистика этапов в порядке их первого запуска (список словарей)
+        """
+        return [stats.as_dict() for stats in self.stats.values()]
+
+    def summary_table(self):
+        """
+        Сводная таблица этапов для вывода в консоль
+        """
+        def megabytes(value):
+            return '-' if value is None else f'{value / (1024 * 1024):.1f}'
+
+        lines = [
+            f"{'Этап':<40} {'Вызовов':>8} {'Время, с':>10} {'Строк':>10} {'Запросов':>9} "
+            f"{'Пик, МБ':>8} {'RSS, МБ':>8}"
+        ]
+        for stats in self.stats.values():
+            name = '  ' * (len(stats.path) - 1) + stats.path[-1]
+            lines.append(
+                f"{name:<40} {stats.calls:>8} {stats.wall_time:>10.3f} {stats.rows:>10} {stats.queries:>9} "
+                f"{megabytes(stats.peak_memory):>8} {megabytes(stats.peak_rss):>8}"
+            )
+        return '\n'.join(lines)
+
+    def write_json(self, path, **extra):
+        """
+        Записать отчет в JSON-файл (extra - дополнительные поля отчета, например параметры запуска)
+        """
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump({**extra, 'phases': self.report()}, report_file, ensure_ascii=False, indent=2)
+
+
+# Замер этапов, общий для процесса
+instrumentation = Instrumentation()
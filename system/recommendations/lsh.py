@@ -0,0 +1,76 @@
+# recommendations/lsh.py
+
+import numpy as np
+from scipy import sparse
+
+
+def hyperplane_signatures(matrix, n_bits, random_state=42):
+    """
+    Сигнатуры строк разреженной матрицы по случайным гиперплоскостям.
+
+    Бит сигнатуры - знак проекции строки на случайный вектор. Вероятность
+    совпадения бита у двух строк равна 1 - угол / pi, поэтому строки
+    с большим косинусным сходством чаще получают одинаковые биты.
+    Возвращает булеву матрицу строки x n_bits
+    """
+    rng = np.random.default_rng(random_state)
+    hyperplanes = rng.standard_normal((matrix.shape[1], n_bits)).astype(np.float32)
+    projections = sparse.csr_matrix(matrix, dtype=np.float32).dot(hyperplanes)
+    return np.asarray(projections) > 0
+
+
+def _band_keys(signatures, bands, rows_per_band):
+    """
+    Ключи корзин: биты каждой полосы сигнатуры, упакованные в целое число
+    """
+    weights = np.left_shift(np.uint64(1), np.arange(rows_per_band, dtype=np.uint64))
+    for band in range(bands):
+        bits = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        yield bits.astype(np.uint64).dot(weights)
+
+
+def bucket_matrix(signatures, bands, rows_per_band, max_bucket=None):
+    """
+    Матрица принадлежности строк корзинам (строки x корзины всех полос).
+
+    Сигнатура делится на bands полос по rows_per_band бит, строки с одинаковыми
+    битами полосы попадают в одну корзину. Корзины больше max_bucket строк
+    делятся на части, чтобы количество пар не росло квадратично. В каждой
+    строке матрицы ровно bands единиц - по одной корзине на полосу
+    """
+    n_rows = signatures.shape[0]
+    positions = np.arange(n_rows)
+    columns = np.empty((n_rows, bands), dtype=np.int64)
+    n_buckets = 0
+
+    for band, keys in enumerate(_band_keys(signatures, bands, rows_per_band)):
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+
+        # Границы корзин (и частей слишком больших корзин)
+        new_bucket = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        if max_bucket:
+            bucket_starts = np.flatnonzero(new_bucket)
+            ranks = positions - np.repeat(bucket_starts, np.diff(np.r_[bucket_starts, n_rows]))
+            new_bucket |= ranks % max_bucket == 0
+
+        columns[order, band] = n_buckets + np.cumsum(new_bucket) - 1
+        n_buckets += int(new_bucket.sum())
+
+    return sparse.csr_matrix(
+        (np.ones(n_rows * bands, dtype=np.float32), columns.ravel(), np.arange(0, n_rows * bands + 1, bands)),
+        shape=(n_rows, n_buckets)
+    )
+
+
+def candidate_matrix(buckets, buckets_t, block_rows):
+    """
+    Кандидаты в соседи для блока строк: строки, которые хотя бы в одной
+    полосе попали в одну корзину со строкой блока. Повторы по разным полосам
+    сливаются умножением разреженных матриц, поэтому память ограничена
+    кандидатами одного блока.
+    Возвращает разреженную матрицу блок x строки с единицами у кандидатов
+    """
+    shared = buckets[block_rows].dot(buckets_t).tocsr()
+    shared.data[:] = 1.0
+    return shared
@@ -1,9 +1,16 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 from recommendations.algorithms import (
     RecommendationEngine, 
+    BatchRecommendationEngine,
     CollaborativeFilteringEngine, 
-    ContentBasedFilteringEngine
+    HybridFilteringEngine,
+    MatrixFactorizationEngine
 )
+from recommendations.cache import bump_similarity_generation
+from recommendations.instrumentation import instrumentation
+from recommendations.matrices import interaction_matrix, interaction_snapshot
+from recommendations.popularity import popularity_leaderboard
 from users.models import User
 import time
 
@@ -22,29 +29,107 @@ class Command(BaseCommand):
             action='store_true',
             help='Обновить матрицы сходства пользователей и треков'
         )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Пересчитать сходство только для пользователей и треков с новыми взаимодействиями'
+        )
+        parser.add_argument(
+            '--batch',
+            action='store_true',
+            help='Рассчитать рекомендации для всех пользователей пакетно (матричными операциями)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Количество пользователей в одной порции пакетного расчета'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Количество процессов для пакетного расчета (диапазоны ID пользователей, только с --batch)'
+        )
+        parser.add_argument(
+            '--report-json',
+            help='Записать замеры этапов (время, строки, память, SQL-запросы) в JSON-файл'
+        )
+        parser.add_argument(
+            '--trace-memory',
+            action='store_true',
+            help='Замерять пик памяти этапов через tracemalloc (замедляет расчет)'
+        )
     
     def handle(self, *args, **options):
+        if options['workers'] > 1 and not options['batch']:
+            raise CommandError('Параметр --workers используется только вместе с --batch')
+        
         start_time = time.time()
+        instrumentation.start(trace_memory=options['trace_memory'])
+        try:
+            self.update(options)
+        finally:
+            instrumentation.stop()
         
+        elapsed_time = time.time() - start_time
+        
+        # Сводка по этапам
+        self.stdout.write(instrumentation.summary_table())
+        if options['report_json']:
+            instrumentation.write_json(
+                options['report_json'],
+                elapsed_time=round(elapsed_time, 6),
+                options={
+                    name: options[name]
+                    for name in ('user_id', 'update_similarities', 'incremental', 'batch', 'chunk_size', 'workers')
+                }
+            )
+            self.stdout.write(f"Отчет о замерах записан в {options['report_json']}")
+        
+        self.stdout.write(self.style.SUCCESS(f"Операция завершена за {elapsed_time:.2f} секунд."))
+    
+    def update(self, options):
+        """
+        Обновить сходство и рекомендации согласно параметрам команды
+        """
         # Обновление матриц сходства
         if options['update_similarities']:
             self.stdout.write("Обновление матриц сходства пользователей и треков...")
             
-            # Обновление матрицы сходства пользователей
-            collab_engine = CollaborativeFilteringEngine()
-            collab_engine.update_user_similarities()
-            self.stdout.write(self.style.SUCCESS("Матрица сходства пользователей обновлена"))
+            use_als = getattr(settings, 'RECOMMENDATION_COLLABORATIVE_BACKEND', 'similarity') == 'als'
+            if use_als:
+                # Обучение модели матричной факторизации вместо матрицы сходства пользователей
+                MatrixFactorizationEngine().train()
+                self.stdout.write(self.style.SUCCESS("Модель матричной факторизации обучена"))
             
-            # Обновление матрицы сходства треков на основе коллаборативной фильтрации
-            collab_engine.update_track_similarities()
-            self.stdout.write(self.style.SUCCESS("Матрица сходства треков (коллаборативная) обновлена"))
+            # Обновление матриц сходства пользователей и треков. Коллаборативное, контентное
+            # и гибридное сходство треков при полном пересчете считаются в одном проходе
+            collab_engine = CollaborativeFilteringEngine()
+            touched = collab_engine.update_similarities(
+                incremental=options['incremental'],
+                user_similarities=not use_als,
+                track_engine=HybridFilteringEngine()
+            )
+            if touched is None:
+                self.stdout.write(self.style.SUCCESS(
+                    "Матрицы сходства пользователей и треков (коллаборативные, контентная "
+                    "и гибридная) пересчитаны полностью"
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Матрицы сходства пользователей и треков обновлены: "
+                    f"пересчитано {touched[0]} пользователей и {touched[1]} треков"
+                ))
             
-            # Обновление матрицы сходства треков на основе контентной фильтрации
-            content_engine = ContentBasedFilteringEngine()
-            content_engine.update_track_content_similarities()
-            self.stdout.write(self.style.SUCCESS("Матрица сходства треков (контентная) обновлена"))
+            # Сбрасываем матрицу взаимодействий, чтобы она соответствовала новому сходству,
+            # и помечаем закэшированные рекомендации как устаревшие
+            interaction_matrix.invalidate()
+            bump_similarity_generation()
         
-        # Обновление рекомендаций
+        # Обновление рекомендаций. Счетчики прослушиваний и лайков меняются в обход
+        # сигналов модели, поэтому рейтинг популярности перечитывается из базы
+        popularity_leaderboard.reset()
         engine = RecommendationEngine()
         
         # Если указан ID пользователя, обновляем рекомендации только для него
@@ -52,13 +137,33 @@ class Command(BaseCommand):
             try:
                 user = User.objects.get(id=options['user_id'])
                 self.stdout.write(f"Обновление рекомендаций для пользователя {user.username}...")
-                recommendations = engine.get_recommendations_for_user(user.id)
+                recommendations = engine.get_recommendations_for_user(user.id, use_cache=False)
                 self.stdout.write(self.style.SUCCESS(
                     f"Рекомендации для пользователя {user.username} обновлены. "
                     f"Получено {len(recommendations)} рекомендаций."
                 ))
             except User.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f"Пользователь с ID {options['user_id']} не найден."))
+        elif options['batch']:
+            # Пакетно обновляем рекомендации для всех пользователей
+            self.stdout.write("Пакетное обновление рекомендаций для всех пользователей...")
+            
+            batch_engine = BatchRecommendationEngine(chunk_size=options['chunk_size'])
+            if options['workers'] > 1:
+                self.stdout.write(f"Используется процессов: {options['workers']}")
+                self.shard_processed = 0
+                processed, batch_time = batch_engine.run_parallel(
+                    options['workers'],
+                    progress=self.report_shard
+                )
+            else:
+                processed, batch_time = batch_engine.run(progress=self.report_progress)
+            
+            users_per_second = processed / batch_time if batch_time > 0 else 0
+            self.stdout.write(self.style.SUCCESS(
+                f"Рекомендации обновлены для {processed} пользователей "
+                f"за {batch_time:.2f} секунд ({users_per_second:.1f} пользователей/сек)."
+            ))
         else:
             # Обновляем рекомендации для всех пользователей
             users = User.objects.all()
@@ -67,7 +172,7 @@ class Command(BaseCommand):
             success_count = 0
             for user in users:
                 try:
-                    recommendations = engine.get_recommendations_for_user(user.id)
+                    recommendations = engine.get_recommendations_for_user(user.id, use_cache=False)
                     success_count += 1
                     self.stdout.write(f"Обновлены рекомендации для {user.username}: {len(recommendations)} рекомендаций")
                 except Exception as e:
@@ -77,5 +182,23 @@ class Command(BaseCommand):
                 f"Рекомендации обновлены для {success_count} из {users.count()} пользователей."
             ))
         
-        elapsed_time = time.time() - start_time
-        self.stdout.write(self.style.SUCCESS(f"Операция завершена за {elapsed_time:.2f} секунд."))
\ No newline at end of file
+        # Снимок матрицы взаимодействий сохраняется здесь, а не при обработке запросов
+        interaction_snapshot.persist()
+    
+    def report_progress(self, processed, total, elapsed):
+        """
+        Вывести прогресс пакетного расчета
+        """
+        users_per_second = processed / elapsed if elapsed > 0 else 0
+        self.stdout.write(f"Обработано {processed}/{total} пользователей ({users_per_second:.1f} пользователей/сек)")
+    
+    def report_shard(self, shard, processed, elapsed):
+        """
+        Вывести время расчета диапазона пользователей и общий прогресс
+        """
+        self.shard_processed += processed
+        first_id, last_id = shard
+        self.stdout.write(
+            f"Пользователи {first_id}-{last_id}: {processed} за {elapsed:.2f} секунд "
+            f"(всего обработано {self.shard_processed})"
+        )
\ No newline at end of file
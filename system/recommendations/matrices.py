@@ -0,0 +1,465 @@
+# recommendations/matrices.py
+
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from tracks.models import Track, UserTrackInteraction
+from .versions import create_version, publish_version, read_version
+
+
+# Веса взаимодействий (лайк имеет больший вес, чем прослушивание)
+INTERACTION_WEIGHTS = {
+    'play': 1.0,
+    'like': 2.0,
+}
+
+
+def lookup_ids(sorted_ids, ids):
+    """
+    Найти позиции ID в отсортированном массиве.
+    Возвращает позиции и маску найденных ID
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return positions, sorted_ids[positions] == ids
+
+
+class CachedMatrix:
+    """
+    Базовый класс для матриц, которые держатся в памяти процесса.
+
+    Матрица перестраивается, если истекло время жизни (настройка
+    RECOMMENDATION_MATRIX_TTL) или если кто-то увеличил ее версию
+    в общем кэше Django через invalidate()
+    """
+    version_key = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._built_at = 0.0
+
+    def build(self):
+        """
+        Построить данные матрицы (реализуется в наследниках)
+        """
+        raise NotImplementedError
+
+    def get(self):
+        """
+        Получить актуальные данные матрицы, при необходимости перестроив их
+        """
+        version = cache.get(self.version_key, 0)
+        ttl = getattr(settings, 'RECOMMENDATION_MATRIX_TTL', 300)
+
+        if (
+            self._data is not None
+            and self._version == version
+            and time.monotonic() - self._built_at < ttl
+        ):
+            return self._data
+
+        with self._lock:
+            # Матрицу мог уже перестроить другой поток
+            if (
+                self._data is None
+                or self._version != version
+                or time.monotonic() - self._built_at >= ttl
+            ):
+                self._data = self.build()
+                self._version = version
+                self._built_at = time.monotonic()
+            return self._data
+
+    def invalidate(self):
+        """
+        Сбросить матрицу во всех процессах, использующих общий кэш
+        """
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, None)
+        self._data = None
+
+
+class InteractionMatrixData:
+    """
+    Разреженная матрица пользователи x треки с весами прослушиваний и лайков
+    """
+
+    def __init__(self, weights, user_ids, track_ids, interaction_counts):
+        self.weights = weights  # scipy.sparse.csr_matrix
+        self.user_ids = user_ids  # Отсортированные ID пользователей (строки)
+        self.track_ids = track_ids  # Отсортированные ID треков (столбцы)
+        self.interaction_counts = interaction_counts  # Количество прослушиваний и лайков пользователей
+
+    def user_rows(self, user_ids):
+        """
+        Найти номера строк для ID пользователей.
+        Возвращает номера строк и маску найденных пользователей
+        """
+        return lookup_ids(self.user_ids, user_ids)
+
+    def track_columns(self, track_ids):
+        """
+        Найти номера столбцов для ID треков.
+        Возвращает номера столбцов и маску найденных треков
+        """
+        return lookup_ids(self.track_ids, track_ids)
+
+
+def _append_interactions(data, interactions):
+    """
+    Добавить взаимодействия (user_id, track_id, interaction_type) к матрице data.
+    Если data=None, матрица строится только из переданных взаимодействий.
+
+    Прежняя матрица не перестраивается: ее строки и столбцы переводятся в
+    объединенные (по-прежнему отсортированные) ID пользователей и треков,
+    после чего к ней прибавляется матрица новых взаимодействий
+    """
+    count = len(interactions)
+    new_user_ids = np.fromiter((row[0] for row in interactions), dtype=np.int64, count=count)
+    new_track_ids = np.fromiter((row[1] for row in interactions), dtype=np.int64, count=count)
+    new_weights = np.fromiter(
+        (INTERACTION_WEIGHTS[row[2]] for row in interactions), dtype=np.float64, count=count
+    )
+
+    if data is not None:
+        user_ids = np.union1d(data.user_ids, new_user_ids)
+        track_ids = np.union1d(data.track_ids, new_track_ids)
+    else:
+        user_ids = np.unique(new_user_ids)
+        track_ids = np.unique(new_track_ids)
+
+    # Повторные взаимодействия с одним треком суммируются
+    matrix = sparse.csr_matrix(
+        (new_weights, (np.searchsorted(user_ids, new_user_ids), np.searchsorted(track_ids, new_track_ids))),
+        shape=(len(user_ids), len(track_ids))
+    )
+    matrix.sum_duplicates()
+
+    interaction_counts = np.bincount(
+        np.searchsorted(user_ids, new_user_ids), minlength=len(user_ids)
+    )
+
+    if data is not None:
+        # Порядок ID сохраняется, поэтому строки и столбцы прежней матрицы только сдвигаются
+        previous = data.weights.tocsr()
+        user_positions = np.searchsorted(user_ids, data.user_ids)
+        row_counts = np.zeros(len(user_ids), dtype=np.int64)
+        row_counts[user_positions] = np.diff(previous.indptr)
+        expanded = sparse.csr_matrix(
+            (
+                previous.data,
+                np.searchsorted(track_ids, data.track_ids)[previous.indices],
+                np.concatenate([[0], np.cumsum(row_counts)]),
+            ),
+            shape=(len(user_ids), len(track_ids))
+        )
+        matrix = (expanded + matrix).tocsr()
+        interaction_counts[user_positions] += data.interaction_counts
+
+    return InteractionMatrixData(matrix, user_ids, track_ids, interaction_counts)
+
+
+class InteractionSnapshot:
+    """
+    Снимок матрицы взаимодействий, сохраненный на диск (.npz).
+
+    Снимок привязан к ID последнего учтенного взаимодействия: при следующем
+    построении из базы читаются только более новые прослушивания и лайки,
+    которые добавляются к снимку. Если учтенные взаимодействия с тех пор
+    удалялись (например, был снят лайк), матрица строится заново.
+    Последний снимок хранится в памяти процесса, поэтому повторное построение
+    без новых взаимодействий стоит одного запроса.
+
+    build() файл не записывает: снимок сохраняет persist(), который вызывают
+    команда update_recommendations и фоновый пересчет рекомендаций, а не
+    обработка запросов
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._last_interaction_id = 0  # ID последнего учтенного взаимодействия
+        self._interaction_total = 0  # Количество учтенных взаимодействий
+        self._saved_state = None  # Состояние, записанное в файл (или прочитанное из него)
+
+    @staticmethod
+    def path():
+        return os.path.join(
+            getattr(settings, 'RECOMMENDATION_DATA_DIR', 'recommendation_data'), 'interactions.npz'
+        )
+
+    def _load(self):
+        path = self.path()
+        if not os.path.exists(path):
+            return
+
+        try:
+            with np.load(path) as snapshot:
+                weights = sparse.csr_matrix(
+                    (snapshot['data'], snapshot['indices'], snapshot['indptr']),
+                    shape=tuple(snapshot['shape'])
+                )
+                self._data = InteractionMatrixData(
+                    weights,
+                    snapshot['user_ids'],
+                    snapshot['track_ids'],
+                    snapshot['interaction_counts']
+                )
+                self._last_interaction_id = int(snapshot['last_interaction_id'])
+                self._interaction_total = int(snapshot['interaction_total'])
+                self._saved_state = (self._last_interaction_id, self._interaction_total)
+        except (OSError, KeyError, ValueError):
+            # Поврежденный снимок будет построен заново
+            self._data = None
+
+    def _save(self):
+        path = self.path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Файл заменяется атомарно, чтобы другие процессы не прочитали его частично
+        tmp_path = f'{path[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+        data = self._data
+        np.savez(
+            tmp_path,
+            data=data.weights.data,
+            indices=data.weights.indices,
+            indptr=data.weights.indptr,
+            shape=np.array(data.weights.shape),
+            user_ids=data.user_ids,
+            track_ids=data.track_ids,
+            interaction_counts=data.interaction_counts,
+            last_interaction_id=self._last_interaction_id,
+            interaction_total=self._interaction_total,
+        )
+        os.replace(tmp_path, path)
+        self._saved_state = (self._last_interaction_id, self._interaction_total)
+
+    def persist(self):
+        """
+        Записать снимок на диск, если он изменился с последней записи
+        """
+        with self._lock:
+            if self._data is not None and self._saved_state != (self._last_interaction_id, self._interaction_total):
+                self._save()
+
+    def build(self):
+        """
+        Получить актуальную матрицу взаимодействий, дополнив снимок новыми взаимодействиями
+        """
+        interactions = UserTrackInteraction.objects.filter(
+            interaction_type__in=list(INTERACTION_WEIGHTS)
+        )
+
+        with self._lock:
+            if self._data is None:
+                self._load()
+
+            # Одним запросом узнаем последнее взаимодействие и сколько из учтенных осталось
+            state = interactions.aggregate(
+                last_id=Max('id'),
+                total=Count('id', filter=Q(id__lte=self._last_interaction_id))
+            )
+            last_interaction_id = state['last_id'] or 0
+
+            if (
+                self._data is not None
+                and self._last_interaction_id <= last_interaction_id
+                and state['total'] == self._interaction_total
+            ):
+                if self._last_interaction_id == last_interaction_id:
+                    return self._data
+                data, since, total = self._data, self._last_interaction_id, self._interaction_total
+            else:
+                # Снимка нет или учтенные взаимодействия изменились - строим матрицу заново
+                data, since, total = None, 0, 0
+
+            new_interactions = list(interactions.filter(
+                id__gt=since,
+                id__lte=last_interaction_id
+            ).values_list('user_id', 'track_id', 'interaction_type'))
+
+            self._data = _append_interactions(data, new_interactions)
+            self._last_interaction_id = last_interaction_id
+            self._interaction_total = total + len(new_interactions)
+
+            return self._data
+
+
+class InteractionMatrix(CachedMatrix):
+    """
+    Матрица взаимодействий пользователей с треками, общая для всех запросов процесса
+    """
+    version_key = 'recommendations:interaction_matrix:version'
+
+    def build(self):
+        return interaction_snapshot.build()
+
+
+class TrackGenreMatrixData:
+    """
+    Разреженная матрица треки x жанры.
+
+    binary - one-hot матрица жанров, normalized - та же матрица, строки которой
+    поделены на количество жанров трека
+    """
+
+    def __init__(self, binary, normalized, track_ids, genre_ids, is_published):
+        self.binary = binary  # scipy.sparse.csr_matrix
+        self.normalized = normalized  # scipy.sparse.csr_matrix
+        self.track_ids = track_ids  # Отсортированные ID треков, у которых есть жанры (строки)
+        self.genre_ids = genre_ids  # Отсортированные ID жанров (столбцы)
+        self.is_published = is_published  # Маска опубликованных треков
+
+    def track_rows(self, track_ids):
+        """
+        Найти номера строк для ID треков.
+        Возвращает номера строк и маску найденных треков
+        """
+        return lookup_ids(self.track_ids, track_ids)
+
+    def genre_columns(self, genre_ids):
+        """
+        Найти номера столбцов для ID жанров.
+        Возвращает номера столбцов и маску найденных жанров
+        """
+        return lookup_ids(self.genre_ids, genre_ids)
+
+
+class TrackGenreMatrix(CachedMatrix):
+    """
+    Матрица жанров треков, общая для всех запросов процесса.
+    Сбрасывается сигналами при изменении треков и их жанров
+    """
+    version_key = 'recommendations:track_genre_matrix:version'
+
+    def build(self):
+        # Одним запросом читаем промежуточную таблицу связи треков и жанров
+        links = list(Track.genres.through.objects.values_list(
+            'track_id', 'genre_id', 'track__is_published'
+        ))
+
+        count = len(links)
+        raw_track_ids = np.fromiter((row[0] for row in links), dtype=np.int64, count=count)
+        raw_genre_ids = np.fromiter((row[1] for row in links), dtype=np.int64, count=count)
+        raw_published = np.fromiter((row[2] for row in links), dtype=bool, count=count)
+
+        track_ids, track_index = np.unique(raw_track_ids, return_inverse=True)
+        genre_ids, genre_index = np.unique(raw_genre_ids, return_inverse=True)
+
+        binary = sparse.csr_matrix(
+            (np.ones(count), (track_index, genre_index)),
+            shape=(len(track_ids), len(genre_ids))
+        )
+        binary.sum_duplicates()
+        binary.data[:] = 1.0
+
+        # Нормализуем строки по количеству жанров трека
+        genre_counts = np.diff(binary.indptr)
+        normalized = sparse.diags(1.0 / np.maximum(genre_counts, 1)).dot(binary).tocsr()
+
+        is_published = np.zeros(len(track_ids), dtype=bool)
+        is_published[track_index] = raw_published
+
+        return TrackGenreMatrixData(binary, normalized, track_ids, genre_ids, is_published)
+
+
+class FactorMatrixData:
+    """
+    Скрытые факторы пользователей и треков, полученные матричной факторизацией
+    """
+    files = ('user_factors', 'track_factors', 'user_ids', 'track_ids')
+
+    def __init__(self, user_factors, track_factors, user_ids, track_ids):
+        self.user_factors = user_factors  # float32, пользователи x факторы
+        self.track_factors = track_factors  # float32, треки x факторы
+        self.user_ids = user_ids  # Отсортированные ID пользователей (строки user_factors)
+        self.track_ids = track_ids  # Отсортированные ID треков (строки track_factors)
+
+    def user_rows(self, user_ids):
+        """
+        Найти номера строк для ID пользователей.
+        Возвращает номера строк и маску найденных пользователей
+        """
+        return lookup_ids(self.user_ids, user_ids)
+
+    def track_columns(self, track_ids):
+        """
+        Найти номера строк факторов для ID треков.
+        Возвращает номера строк и маску найденных треков
+        """
+        return lookup_ids(self.track_ids, track_ids)
+
+    @staticmethod
+    def directory():
+        return os.path.join(
+            getattr(settings, 'RECOMMENDATION_DATA_DIR', 'recommendation_data'), 'factors'
+        )
+
+    def save(self):
+        """
+        Сохранить факторы на диск.
+        Файлы записываются в новый каталог версии, после чего файл CURRENT
+        атомарно переключается на нее: читатели видят либо все файлы старой
+        модели, либо все файлы новой. Процессы, которые уже отобразили старые
+        файлы в память, продолжают работать со старой моделью
+        """
+        version, version_directory = create_version(self.directory())
+        for name in self.files:
+            np.save(os.path.join(version_directory, f'{name}.npy'), getattr(self, name))
+
+        publish_version(self.directory(), version)
+
+    @classmethod
+    def load(cls):
+        """
+        Загрузить факторы с диска, отображая файлы в память.
+        Возвращает None, если модель еще не обучена
+        """
+        version = read_version(cls.directory())
+        while version is not None:
+            version_directory = os.path.join(cls.directory(), version)
+            try:
+                return cls(*(
+                    np.load(os.path.join(version_directory, f'{name}.npy'), mmap_mode='r')
+                    for name in cls.files
+                ))
+            except FileNotFoundError:
+                # Версию заменили во время чтения - читаем новую
+                latest = read_version(cls.directory())
+                if latest == version:
+                    raise
+                version = latest
+        return None
+
+
+class FactorMatrix(CachedMatrix):
+    """
+    Модель матричной факторизации, общая для всех запросов процесса.
+    Сбрасывается после обучения новой модели
+    """
+    version_key = 'recommendations:factor_matrix:version'
+
+    def build(self):
+        return FactorMatrixData.load()
+
+
+# Общие экземпляры матриц для процесса
+interaction_snapshot = InteractionSnapshot()
+interaction_matrix = InteractionMatrix()
+track_genre_matrix = TrackGenreMatrix()
+factor_matrix = FactorMatrix()
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+                ('last_interaction_id', models.PositiveBigIntegerField(default=0, verbose_name='ID последнего взаимодействия')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Отметка расчета сходства',
+                'verbose_name_plural': 'Отметки расчета сходства',
+            },
+        ),
+    ]
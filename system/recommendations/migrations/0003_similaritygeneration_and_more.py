@@ -0,0 +1,71 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0002_similaritywatermark'),
+        ('tracks', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+                ('generation', models.PositiveIntegerField(default=0, verbose_name='Активное поколение')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Поколение сходства',
+                'verbose_name_plural': 'Поколения сходства',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='tracksimilarity',
+            name='recommendat_track_a_aade50_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='usersimilarity',
+            name='recommendat_user_a__d78cbb_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='tracksimilarity',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersimilarity',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='tracksimilarity',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Поколение'),
+        ),
+        migrations.AddField(
+            model_name='usersimilarity',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Поколение'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tracksimilarity',
+            unique_together={('generation', 'track_a', 'track_b', 'similarity_type')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersimilarity',
+            unique_together={('generation', 'user_a', 'user_b')},
+        ),
+        migrations.AddIndex(
+            model_name='tracksimilarity',
+            index=models.Index(fields=['track_a', 'generation', 'similarity_score'], name='recommendat_track_a_df1361_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersimilarity',
+            index=models.Index(fields=['user_a', 'generation', 'similarity_score'], name='recommendat_user_a__987ab3_idx'),
+        ),
+    ]
@@ -22,14 +22,16 @@ class UserSimilarity(models.Model):
         verbose_name=_('Пользователь B')
     )
     similarity_score = models.FloatField(_('Показатель сходства'))
+    # Поколение расчета сходства (см. SimilarityGeneration)
+    generation = models.PositiveIntegerField(_('Поколение'), default=0)
     last_updated = models.DateTimeField(auto_now=True)
     
     class Meta:
-        unique_together = ('user_a', 'user_b')
+        unique_together = ('generation', 'user_a', 'user_b')
         verbose_name = _('Сходство пользователей')
         verbose_name_plural = _('Сходства пользователей')
         indexes = [
-            models.Index(fields=['user_a', 'similarity_score']),
+            models.Index(fields=['user_a', 'generation', 'similarity_score']),
             models.Index(fields=['user_b', 'similarity_score']),
         ]
     
@@ -64,14 +66,16 @@ class TrackSimilarity(models.Model):
         ],
         default='collaborative'
     )
+    # Поколение расчета сходства (см. SimilarityGeneration)
+    generation = models.PositiveIntegerField(_('Поколение'), default=0)
     last_updated = models.DateTimeField(auto_now=True)
     
     class Meta:
-        unique_together = ('track_a', 'track_b', 'similarity_type')
+        unique_together = ('generation', 'track_a', 'track_b', 'similarity_type')
         verbose_name = _('Сходство треков')
         verbose_name_plural = _('Сходства треков')
         indexes = [
-            models.Index(fields=['track_a', 'similarity_score']),
+            models.Index(fields=['track_a', 'generation', 'similarity_score']),
             models.Index(fields=['track_b', 'similarity_score']),
         ]
     
@@ -79,6 +83,43 @@ class TrackSimilarity(models.Model):
         return f"Сходство между треками {self.track_a.id} и {self.track_b.id}: {self.similarity_score}"
 
 
+class SimilarityWatermark(models.Model):
+    """
+    Последнее взаимодействие, учтенное при расчете сходства.
+    Используется для инкрементального обновления матриц сходства
+    """
+    name = models.CharField(_('Название'), max_length=50, unique=True)
+    last_interaction_id = models.PositiveBigIntegerField(_('ID последнего взаимодействия'), default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Отметка расчета сходства')
+        verbose_name_plural = _('Отметки расчета сходства')
+    
+    def __str__(self):
+        return f"{self.name}: взаимодействие {self.last_interaction_id}"
+
+
+class SimilarityGeneration(models.Model):
+    """
+    Активное поколение таблицы сходства.
+    
+    Новый расчет сходства записывается под следующим номером поколения, после
+    чего активное поколение переключается одним запросом, а записи старых
+    поколений удаляются. Пока идет расчет, чтение использует прежнее поколение
+    """
+    name = models.CharField(_('Название'), max_length=50, unique=True)
+    generation = models.PositiveIntegerField(_('Активное поколение'), default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Поколение сходства')
+        verbose_name_plural = _('Поколения сходства')
+    
+    def __str__(self):
+        return f"{self.name}: поколение {self.generation}"
+
+
 class UserPreference(models.Model):
     """
     Явные предпочтения пользователя (например, любимые жанры)
@@ -0,0 +1,149 @@
+# recommendations/neighbours.py
+
+import os
+import threading
+
+import numpy as np
+
+from django.conf import settings
+
+from .versions import create_version, publish_version, read_version
+
+
+class NeighbourListData:
+    """
+    Упакованные списки соседей всех объектов (пользователей или треков).
+
+    Соседи объекта entity_ids[i] хранятся в neighbour_ids[offsets[i]:offsets[i + 1]]
+    (int32) со сходством в scores (float32) в порядке убывания сходства
+    """
+
+    def __init__(self, entity_ids, offsets, neighbour_ids, scores):
+        self.entity_ids = entity_ids  # Отсортированные ID объектов
+        self.offsets = offsets  # Начало списка соседей каждого объекта
+        self.neighbour_ids = neighbour_ids
+        self.scores = scores
+
+    def neighbours(self, entity_id):
+        """
+        Соседи объекта: массивы ID и сходства
+        """
+        idx = np.searchsorted(self.entity_ids, entity_id)
+        if idx >= len(self.entity_ids) or self.entity_ids[idx] != entity_id:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.neighbour_ids[start:end], self.scores[start:end]
+
+    def pairs(self):
+        """
+        Все пары в виде массивов (ID объекта, ID соседа, сходство),
+        упорядоченные по объекту и убыванию сходства
+        """
+        entity_ids = np.repeat(self.entity_ids, np.diff(self.offsets))
+        return (
+            entity_ids.astype(np.int64),
+            np.asarray(self.neighbour_ids, dtype=np.int64),
+            np.asarray(self.scores, dtype=np.float64),
+        )
+
+
+class NeighbourStore:
+    """
+    Хранилище списков соседей в файлах, отображаемых в память.
+
+    Каждая запись сохраняется в отдельный каталог версии, после чего файл
+    CURRENT атомарно переключается на нее. Процессы перечитывают данные,
+    когда CURRENT меняется; уже отображенные в память старые файлы остаются
+    доступны до конца чтения
+    """
+    files = ('entity_ids', 'offsets', 'neighbour_ids', 'scores')
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+
+    @property
+    def directory(self):
+        return os.path.join(
+            getattr(settings, 'RECOMMENDATION_DATA_DIR', 'recommendation_data'),
+            'neighbours',
+            self.name.replace(':', '-')
+        )
+
+    def write(self, ids_a, ids_b, scores):
+        """
+        Заменить все списки соседей парами (ID объекта, ID соседа, сходство)
+        """
+        ids_a = np.asarray(ids_a, dtype=np.int64)
+        ids_b = np.asarray(ids_b, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+
+        # Группируем пары по объектам, внутри объекта - по убыванию сходства
+        order = np.lexsort((-scores, ids_a))
+        ids_a, ids_b, scores = ids_a[order], ids_b[order], scores[order]
+        entity_ids, counts = np.unique(ids_a, return_counts=True)
+
+        arrays = {
+            'entity_ids': entity_ids,
+            'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            'neighbour_ids': ids_b.astype(np.int32),
+            'scores': scores.astype(np.float32),
+        }
+
+        version, version_directory = create_version(self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(version_directory, f'{name}.npy'), array)
+
+        # Переключаем CURRENT на новую версию
+        publish_version(self.directory, version)
+
+    def load(self):
+        """
+        Получить актуальные списки соседей (None, если они еще не записаны)
+        """
+        version = read_version(self.directory)
+        if version is None:
+            return None
+
+        if self._data is not None and self._version == version:
+            return self._data
+
+        with self._lock:
+            if self._data is None or self._version != version:
+                version_directory = os.path.join(self.directory, version)
+                try:
+                    self._data = NeighbourListData(*(
+                        np.load(os.path.join(version_directory, f'{name}.npy'), mmap_mode='r')
+                        for name in self.files
+                    ))
+                except FileNotFoundError:
+                    # Версию только что заменили - прочитаем новую при следующем обращении
+                    return self._data
+                self._version = version
+            return self._data
+
+    def neighbours(self, entity_id, limit=None):
+        """
+        Соседи объекта одним обращением: массивы ID и сходства по убыванию сходства
+        """
+        data = self.load()
+        if data is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        neighbour_ids, scores = data.neighbours(entity_id)
+        return (
+            np.asarray(neighbour_ids[:limit], dtype=np.int64),
+            np.asarray(scores[:limit], dtype=np.float64),
+        )
+
+    def pairs(self):
+        """
+        Все пары (ID объекта, ID соседа, сходство)
+        """
+        data = self.load()
+        if data is None:
+            return tuple(np.empty(0, dtype=dtype) for dtype in (np.int64, np.int64, np.float64))
+        return data.pairs()
@@ -0,0 +1,138 @@
+# recommendations/popularity.py
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from tracks.models import Track
+
+
+class PopularityLeaderboard:
+    """
+    Рейтинг опубликованных треков по популярности, который хранится в памяти процесса.
+
+    Треки упорядочены по количеству прослушиваний, затем по количеству лайков.
+    Рейтинг обновляется сигналами при изменении счетчиков трека и полностью
+    перечитывается из базы раз в RECOMMENDATION_LEADERBOARD_TTL секунд, чтобы
+    учесть изменения, сделанные другими процессами.
+
+    Для нормализации оценок отдельно хранится количество прослушиваний всех
+    треков, включая неопубликованные
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []  # Отсортированный список ключей (-play_count, -like_count, track_id)
+        self._key_by_track = {}  # {track_id: ключ}
+        self._play_keys = []  # Отсортированный список (-play_count, track_id) всех треков
+        self._plays_by_track = {}  # {track_id: play_count} всех треков
+        self._loaded_at = None
+
+    @staticmethod
+    def _make_key(track_id, play_count, like_count):
+        return (-play_count, -like_count, track_id)
+
+    def _ensure_loaded(self):
+        ttl = getattr(settings, 'RECOMMENDATION_LEADERBOARD_TTL', 3600)
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < ttl:
+            return
+
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < ttl:
+                return
+
+            # Одним запросом читаем счетчики всех треков
+            tracks = list(Track.objects.values_list('id', 'play_count', 'like_count', 'is_published'))
+            key_by_track = {
+                track_id: self._make_key(track_id, play_count, like_count)
+                for track_id, play_count, like_count, is_published in tracks
+                if is_published
+            }
+            plays_by_track = {track_id: play_count for track_id, play_count, _, _ in tracks}
+
+            self._keys = sorted(key_by_track.values())
+            self._key_by_track = key_by_track
+            self._play_keys = sorted((-play_count, track_id) for track_id, play_count in plays_by_track.items())
+            self._plays_by_track = plays_by_track
+            self._loaded_at = time.monotonic()
+
+    def _remove_key(self, track_id):
+        key = self._key_by_track.pop(track_id, None)
+        if key is not None:
+            idx = bisect_left(self._keys, key)
+            if idx < len(self._keys) and self._keys[idx] == key:
+                del self._keys[idx]
+
+    def _remove_plays(self, track_id):
+        play_count = self._plays_by_track.pop(track_id, None)
+        if play_count is not None:
+            key = (-play_count, track_id)
+            idx = bisect_left(self._play_keys, key)
+            if idx < len(self._play_keys) and self._play_keys[idx] == key:
+                del self._play_keys[idx]
+
+    def update(self, track_id, play_count, like_count, is_published=True):
+        """
+        Обновить счетчики трека в рейтинге
+        """
+        if self._loaded_at is None:
+            # Рейтинг еще не загружен - он прочитает актуальные данные из базы
+            return
+
+        with self._lock:
+            self._remove_key(track_id)
+            if is_published:
+                key = self._make_key(track_id, play_count, like_count)
+                self._key_by_track[track_id] = key
+                insort(self._keys, key)
+
+            self._remove_plays(track_id)
+            self._plays_by_track[track_id] = play_count
+            insort(self._play_keys, (-play_count, track_id))
+
+    def remove(self, track_id):
+        """
+        Убрать трек из рейтинга
+        """
+        with self._lock:
+            self._remove_key(track_id)
+            self._remove_plays(track_id)
+
+    def top(self, limit, exclude=()):
+        """
+        Получить limit самых популярных треков, кроме треков из exclude.
+        Возвращает список (track_id, play_count, like_count)
+        """
+        self._ensure_loaded()
+
+        result = []
+        with self._lock:
+            for neg_plays, neg_likes, track_id in self._keys:
+                if track_id in exclude:
+                    continue
+                result.append((track_id, -neg_plays, -neg_likes))
+                if len(result) >= limit:
+                    break
+        return result
+
+    def max_play_count(self):
+        """
+        Максимальное количество прослушиваний среди всех треков (и неопубликованных)
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            return -self._play_keys[0][0] if self._play_keys else 0
+
+    def reset(self):
+        """
+        Сбросить рейтинг, чтобы при следующем обращении он был перечитан из базы
+        """
+        with self._lock:
+            self._loaded_at = None
+
+
+# Общий рейтинг для процесса
+popularity_leaderboard = PopularityLeaderboard()
@@ -0,0 +1,70 @@
+# recommendations/profiles.py
+
+from django.db.models import CharField, F, FloatField, Value
+
+from tracks.models import UserTrackInteraction
+from .matrices import INTERACTION_WEIGHTS
+from .models import UserPreference
+
+
+class UserProfileSnapshot:
+    """
+    Снимок данных пользователя, нужных движку рекомендаций.
+
+    Строится одним запросом на каждый вызов движка и передается во все
+    источники рекомендаций, чтобы они не обращались к базе повторно
+    """
+
+    def __init__(self, user_id, interacted_track_ids=None, liked_track_ids=None,
+                 genre_weights=None, interaction_count=0, last_interaction_id=None):
+        self.user_id = user_id
+        # Треки, которые пользователь прослушал или лайкнул
+        self.interacted_track_ids = interacted_track_ids or set()
+        # Треки, которые пользователь лайкнул
+        self.liked_track_ids = liked_track_ids or set()
+        # Явные предпочтения пользователя {genre_id: weight}
+        self.genre_weights = genre_weights or {}
+        # Количество прослушиваний и лайков
+        self.interaction_count = interaction_count
+        # ID последнего взаимодействия (для проверки актуальности)
+        self.last_interaction_id = last_interaction_id
+
+    @classmethod
+    def build(cls, user_id):
+        """
+        Загрузить снимок пользователя одним запросом (UNION взаимодействий и предпочтений)
+        """
+        interactions = UserTrackInteraction.objects.filter(
+            user_id=user_id,
+            interaction_type__in=list(INTERACTION_WEIGHTS)
+        ).annotate(
+            row_id=F('id'),
+            entity_id=F('track_id'),
+            kind=F('interaction_type'),
+            value=Value(0.0, output_field=FloatField()),
+        ).values_list('row_id', 'entity_id', 'kind', 'value')
+
+        preferences = UserPreference.objects.filter(
+            user_id=user_id
+        ).annotate(
+            row_id=F('id'),
+            entity_id=F('genre_id'),
+            kind=Value('preference', output_field=CharField()),
+            value=F('weight'),
+        ).values_list('row_id', 'entity_id', 'kind', 'value')
+
+        snapshot = cls(user_id)
+
+        for row_id, entity_id, kind, value in interactions.union(preferences, all=True):
+            if kind == 'preference':
+                snapshot.genre_weights[entity_id] = value
+                continue
+
+            snapshot.interaction_count += 1
+            snapshot.interacted_track_ids.add(entity_id)
+            if kind == 'like':
+                snapshot.liked_track_ids.add(entity_id)
+            if snapshot.last_interaction_id is None or row_id > snapshot.last_interaction_id:
+                snapshot.last_interaction_id = row_id
+
+        return snapshot
@@ -0,0 +1,109 @@
+# recommendations/projections.py
+
+import os
+
+import numpy as np
+from scipy import sparse
+from sklearn.utils.extmath import randomized_svd
+
+from django.conf import settings
+
+
+class LatentProjection:
+    """
+    Проекция строк разреженной матрицы в k-мерное скрытое пространство
+    (усеченное SVD, рассчитанное рандомизированным методом).
+
+    Координаты строки - произведение строки на правые сингулярные векторы,
+    поэтому новые строки (новые треки или пользователи) проецируются той же
+    матрицей без пересчета разложения. Столбцы сопоставляются по column_ids:
+    столбцы, которых не было при расчете, не учитываются
+    """
+
+    def __init__(self, name, components, column_ids):
+        self.name = name
+        self.components = components  # Правые сингулярные векторы: k x столбцы
+        self.column_ids = column_ids  # ID (метки) столбцов исходной матрицы
+
+    @classmethod
+    def fit(cls, name, matrix, column_ids, n_components, random_state=42):
+        """
+        Рассчитать проекцию по матрице строки x столбцы
+        """
+        n_components = max(1, min(n_components, min(matrix.shape) - 1))
+        _, _, components = randomized_svd(
+            sparse.csr_matrix(matrix, dtype=np.float64),
+            n_components,
+            random_state=random_state
+        )
+        return cls(name, components.astype(np.float32), np.asarray(column_ids))
+
+    def transform(self, matrix, column_ids=None):
+        """
+        Координаты строк матрицы в скрытом пространстве (плотная матрица строки x k)
+        """
+        matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+        components = self.components
+
+        if column_ids is not None:
+            # Выравниваем столбцы матрицы по столбцам проекции
+            column_ids = np.asarray(column_ids)
+            order = np.argsort(self.column_ids)
+            positions = np.searchsorted(self.column_ids, column_ids, sorter=order)
+            positions = np.minimum(positions, len(order) - 1)
+            found = self.column_ids[order[positions]] == column_ids
+
+            matrix = matrix[:, np.flatnonzero(found)]
+            components = components[:, order[positions[found]]]
+
+        return np.asarray(matrix.dot(components.T))
+
+    @staticmethod
+    def path(name):
+        return os.path.join(
+            getattr(settings, 'RECOMMENDATION_DATA_DIR', 'recommendation_data'),
+            'projections',
+            f"{name}.npz"
+        )
+
+    def save(self):
+        """
+        Сохранить проекцию на диск (файл заменяется атомарно)
+        """
+        path = self.path(self.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f'{path[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, components=self.components, column_ids=self.column_ids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, name):
+        """
+        Загрузить проекцию с диска. Возвращает None, если она еще не рассчитана
+        """
+        try:
+            with np.load(cls.path(name)) as projection:
+                return cls(name, projection['components'], projection['column_ids'])
+        except FileNotFoundError:
+            return None
+
+
+def project_rows(name, matrix, column_ids, refit=True):
+    """
+    Спроецировать строки матрицы в скрытое пространство размерности
+    RECOMMENDATION_SIMILARITY_SVD_COMPONENTS.
+
+    При refit=True (полный пересчет) проекция рассчитывается заново и сохраняется,
+    иначе используется сохраненная проекция (строки встраиваются в нее)
+    """
+    projection = None if refit else LatentProjection.load(name)
+
+    if projection is None:
+        projection = LatentProjection.fit(
+            name, matrix, column_ids,
+            getattr(settings, 'RECOMMENDATION_SIMILARITY_SVD_COMPONENTS', None) or 64
+        )
+        projection.save()
+
+    return projection.transform(matrix, column_ids)
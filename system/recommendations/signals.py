@@ -0,0 +1,90 @@
+# recommendations/signals.py
+
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from tracks.models import Track, Genre, UserTrackInteraction
+from .audio_features import audio_feature_store
+from .cache import recommendation_cache
+from .matrices import INTERACTION_WEIGHTS, track_genre_matrix
+from .models import UserPreference
+from .popularity import popularity_leaderboard
+
+
+@receiver(post_save, sender=Track)
+def invalidate_genre_matrix_on_track_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Сбрасывает матрицу жанров при добавлении трека или изменении статуса публикации
+    """
+    # Обновление счетчиков прослушиваний и лайков не влияет на матрицу жанров
+    if created or update_fields is None or 'is_published' in update_fields:
+        track_genre_matrix.invalidate()
+
+
+@receiver(post_delete, sender=Track)
+@receiver(post_delete, sender=Genre)
+def invalidate_genre_matrix_on_delete(sender, instance, **kwargs):
+    """
+    Сбрасывает матрицу жанров при удалении трека или жанра
+    """
+    track_genre_matrix.invalidate()
+
+
+@receiver(m2m_changed, sender=Track.genres.through)
+def invalidate_genre_matrix_on_genres_change(sender, instance, action, **kwargs):
+    """
+    Сбрасывает матрицу жанров при изменении жанров трека
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        track_genre_matrix.invalidate()
+
+
+@receiver(post_save, sender=Track)
+def update_audio_feature_store(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Записывает аудио-характеристики трека в хранилище при их сохранении
+    """
+    if created or update_fields is None or 'audio_features' in update_fields:
+        audio_feature_store.update(instance.id, instance.audio_features)
+
+
+@receiver(post_save, sender=Track)
+def update_popularity_leaderboard(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Обновляет рейтинг популярности при изменении счетчиков или статуса публикации трека
+    """
+    tracked_fields = {'play_count', 'like_count', 'is_published'}
+    if created or update_fields is None or tracked_fields & set(update_fields):
+        popularity_leaderboard.update(
+            instance.id,
+            instance.play_count,
+            instance.like_count,
+            is_published=instance.is_published
+        )
+
+
+@receiver(post_delete, sender=Track)
+def remove_from_popularity_leaderboard(sender, instance, **kwargs):
+    """
+    Убирает удаленный трек из рейтинга популярности
+    """
+    popularity_leaderboard.remove(instance.id)
+
+
+@receiver(post_save, sender=UserTrackInteraction)
+@receiver(post_delete, sender=UserTrackInteraction)
+def invalidate_recommendations_on_interaction(sender, instance, **kwargs):
+    """
+    Сбрасывает закэшированные рекомендации пользователя после прослушивания или лайка
+    """
+    if instance.interaction_type in INTERACTION_WEIGHTS:
+        recommendation_cache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=UserPreference)
+@receiver(post_delete, sender=UserPreference)
+def invalidate_recommendations_on_preference(sender, instance, **kwargs):
+    """
+    Сбрасывает закэшированные рекомендации пользователя при изменении его предпочтений
+    """
+    recommendation_cache.invalidate(instance.user_id)
@@ -0,0 +1,276 @@
+# recommendations/similarity_storage.py
+
+import numpy as np
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .generations import (
+    USER_SIMILARITY, active_generation, active_track_similarities, activate_generation,
+    get_active_generation, start_generation, track_similarity_name
+)
+from .models import UserSimilarity, TrackSimilarity
+from .neighbours import NeighbourStore
+
+
+def _insert_similarities(model, fields, ids_a, ids_b, scores, **values):
+    """
+    Записать пары сходства в таблицу модели без создания объектов модели.
+
+    fields - названия полей пары (A, B); values - значения остальных полей,
+    одинаковые для всех записей (например, поколение). Записи вставляются
+    запросами executemany пакетами по RECOMMENDATION_SIMILARITY_INSERT_BATCH строк.
+    Возвращает количество записанных пар
+    """
+    opts = model._meta
+    field_names = [*fields, 'similarity_score', *values, 'last_updated']
+    columns = ', '.join(connection.ops.quote_name(opts.get_field(name).column) for name in field_names)
+    placeholders = ', '.join(['%s'] * len(field_names))
+    sql = f'INSERT INTO {connection.ops.quote_name(opts.db_table)} ({columns}) VALUES ({placeholders})'
+
+    constants = (*values.values(), connection.ops.adapt_datetimefield_value(timezone.now()))
+    batch_size = getattr(settings, 'RECOMMENDATION_SIMILARITY_INSERT_BATCH', 10000)
+
+    ids_a, ids_b, scores = np.asarray(ids_a), np.asarray(ids_b), np.asarray(scores)
+    with connection.cursor() as cursor:
+        for start in range(0, len(scores), batch_size):
+            end = start + batch_size
+            cursor.executemany(sql, [
+                (id_a, id_b, score, *constants)
+                for id_a, id_b, score in zip(
+                    ids_a[start:end].tolist(), ids_b[start:end].tolist(), scores[start:end].tolist()
+                )
+            ])
+
+    return len(scores)
+
+
+def _pair_arrays(rows):
+    """
+    Преобразовать список (ID A, ID B, сходство) в массивы
+    """
+    count = len(rows)
+    return (
+        np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+        np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+        np.fromiter((row[2] for row in rows), dtype=np.float64, count=count),
+    )
+
+
+class DatabaseSimilarityStorage:
+    """
+    Хранение сходства в таблице UserSimilarity или TrackSimilarity: одна запись на пару.
+
+    Полный пересчет записывается в новое поколение (см. generations.py), чтение
+    и инкрементальные изменения работают с активным поколением
+    """
+
+    def __init__(self, model, fields, generation_name, **values):
+        self.model = model
+        self.fields = fields  # Названия полей пары (A, B)
+        self.generation_name = generation_name
+        self.values = values  # Значения остальных полей (например, тип сходства)
+        self.queryset = model.objects.filter(**values)
+        self.generation = None
+
+    def _active(self):
+        return self.queryset.filter(generation=active_generation(self.generation_name))
+
+    def start(self):
+        """
+        Начать полную запись сходства
+        """
+        self.generation = start_generation(self.generation_name, self.queryset)
+
+    def write(self, ids_a, ids_b, scores):
+        """
+        Записать порцию пар при полной записи
+        """
+        _insert_similarities(
+            self.model, self.fields, ids_a, ids_b, scores,
+            generation=self.generation, **self.values
+        )
+
+    def finish(self):
+        """
+        Завершить полную запись: переключиться на новое поколение
+        """
+        activate_generation(self.generation_name, self.generation, self.queryset)
+
+    def neighbours(self, entity_id, limit=None):
+        """
+        Соседи объекта: массивы ID и сходства по убыванию сходства
+        """
+        field_a, field_b = self.fields
+        rows = self._active().filter(
+            **{f'{field_a}_id': entity_id}
+        ).order_by('-similarity_score').values_list(f'{field_b}_id', 'similarity_score')
+        if limit is not None:
+            rows = rows[:limit]
+
+        rows = list(rows)
+        return (
+            np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+        )
+
+    def pairs(self):
+        """
+        Все пары (ID A, ID B, сходство), упорядоченные по A и убыванию сходства
+        """
+        field_a, field_b = self.fields
+        return _pair_arrays(list(self._active().order_by(
+            field_a, '-similarity_score'
+        ).values_list(f'{field_a}_id', f'{field_b}_id', 'similarity_score')))
+
+    def linked(self, ids_b):
+        """
+        ID объектов, среди соседей которых есть объекты ids_b
+        """
+        field_a, field_b = self.fields
+        return np.fromiter(self._active().filter(
+            **{f'{field_b}__in': list(ids_b)}
+        ).values_list(f'{field_a}_id', flat=True).distinct(), dtype=np.int64)
+
+    def stored_pairs(self, ids_a):
+        """
+        Сохраненные пары объектов ids_a
+        """
+        field_a, field_b = self.fields
+        return _pair_arrays(list(self._active().filter(
+            **{f'{field_a}__in': list(ids_a)}
+        ).values_list(f'{field_a}_id', f'{field_b}_id', 'similarity_score')))
+
+    def replace(self, replaced_ids, ids_a, ids_b, scores):
+        """
+        Заменить соседей объектов replaced_ids парами (ids_a, ids_b, scores)
+        """
+        field_a, _ = self.fields
+        generation = get_active_generation(self.generation_name)
+
+        with transaction.atomic():
+            self.queryset.filter(
+                generation=generation,
+                **{f'{field_a}__in': list(replaced_ids)}
+            ).delete()
+            _insert_similarities(
+                self.model, self.fields, ids_a, ids_b, scores,
+                generation=generation, **self.values
+            )
+
+
+class PackedSimilarityStorage:
+    """
+    Хранение сходства в упакованных списках соседей (см. neighbours.py):
+    8 байт на пару вместо строки таблицы с индексами
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._parts = None
+
+    def start(self):
+        self._parts = []
+
+    def write(self, ids_a, ids_b, scores):
+        self._parts.append((np.asarray(ids_a), np.asarray(ids_b), np.asarray(scores)))
+
+    def finish(self):
+        parts = self._parts or [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))]
+        self.store.write(*(np.concatenate([part[idx] for part in parts]) for idx in range(3)))
+        self._parts = None
+
+    def neighbours(self, entity_id, limit=None):
+        return self.store.neighbours(entity_id, limit)
+
+    def pairs(self):
+        return self.store.pairs()
+
+    def linked(self, ids_b):
+        ids_a, neighbour_ids, _ = self.store.pairs()
+        return np.unique(ids_a[np.isin(neighbour_ids, list(ids_b))])
+
+    def stored_pairs(self, ids_a):
+        all_a, all_b, all_scores = self.store.pairs()
+        mask = np.isin(all_a, list(ids_a))
+        return all_a[mask], all_b[mask], all_scores[mask]
+
+    def replace(self, replaced_ids, ids_a, ids_b, scores):
+        all_a, all_b, all_scores = self.store.pairs()
+        keep = ~np.isin(all_a, list(replaced_ids))
+        self.store.write(
+            np.concatenate([all_a[keep], ids_a]),
+            np.concatenate([all_b[keep], ids_b]),
+            np.concatenate([all_scores[keep], scores]),
+        )
+
+
+# Упакованные списки соседей, общие для процесса
+_neighbour_stores = {}
+
+
+def _packed_storage(name):
+    if name not in _neighbour_stores:
+        _neighbour_stores[name] = NeighbourStore(name)
+    return PackedSimilarityStorage(_neighbour_stores[name])
+
+
+def _use_packed_storage():
+    return getattr(settings, 'RECOMMENDATION_SIMILARITY_STORAGE', 'database') == 'packed'
+
+
+def user_similarity_storage():
+    """
+    Хранилище сходства пользователей (по настройке RECOMMENDATION_SIMILARITY_STORAGE)
+    """
+    if _use_packed_storage():
+        return _packed_storage(USER_SIMILARITY)
+    return DatabaseSimilarityStorage(UserSimilarity, ('user_a', 'user_b'), USER_SIMILARITY)
+
+
+def track_similarity_storage(similarity_type):
+    """
+    Хранилище сходства треков заданного типа (по настройке RECOMMENDATION_SIMILARITY_STORAGE)
+    """
+    name = track_similarity_name(similarity_type)
+    if _use_packed_storage():
+        return _packed_storage(name)
+    return DatabaseSimilarityStorage(
+        TrackSimilarity, ('track_a', 'track_b'), name,
+        similarity_type=similarity_type
+    )
+
+
+def get_similar_track_ids(track_id, limit=5):
+    """
+    ID треков, наиболее похожих на трек, по убыванию сходства.
+
+    Читается готовый список гибридного сходства; если для трека его еще нет,
+    списки всех типов сходства объединяются при запросе
+    """
+    hybrid_ids, _ = track_similarity_storage('hybrid').neighbours(track_id, limit)
+    if len(hybrid_ids):
+        return hybrid_ids.tolist()
+
+    if _use_packed_storage():
+        # По одному обращению к спискам соседей каждого типа сходства
+        similar = [
+            track_similarity_storage(similarity_type).neighbours(track_id, limit)
+            for similarity_type, _ in TrackSimilarity._meta.get_field('similarity_type').choices
+        ]
+        ids = np.concatenate([ids for ids, _ in similar])
+        scores = np.concatenate([scores for _, scores in similar])
+        order = np.argsort(-scores, kind='stable')[:limit]
+        return ids[order].tolist()
+
+    similar_tracks = TrackSimilarity.objects.filter(
+        Q(track_a_id=track_id) | Q(track_b_id=track_id),
+        active_track_similarities()
+    ).order_by('-similarity_score').values_list('track_a_id', 'track_b_id')[:limit]
+
+    return [
+        track_b_id if track_a_id == track_id else track_a_id
+        for track_a_id, track_b_id in similar_tracks
+    ]
@@ -0,0 +1,77 @@
+import io
+import tempfile
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tracks.models import Track
+from users.models import User
+from .algorithms import BatchRecommendationEngine, MatrixFactorizationEngine, _write_recommendation_changes
+from .matrices import factor_matrix, interaction_matrix, track_genre_matrix
+from .models import UserTrackRecommendation
+
+
+class BatchRecommendationsWithoutInteractionsTest(TestCase):
+    """
+    Пакетный расчет для пользователей, у которых еще нет прослушиваний
+    (матрица взаимодействий пуста)
+    """
+
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(RECOMMENDATION_DATA_DIR=self.data_dir.name)
+        self.settings_override.enable()
+
+        for name in ('first', 'second', 'third'):
+            User.objects.create_user(username=name, password='password')
+
+        interaction_matrix.invalidate()
+        track_genre_matrix.invalidate()
+        factor_matrix.invalidate()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.data_dir.cleanup()
+
+    def test_similarity_backend(self):
+        processed, _ = BatchRecommendationEngine().run()
+        self.assertEqual(processed, 3)
+
+    @override_settings(RECOMMENDATION_COLLABORATIVE_BACKEND='als')
+    def test_als_backend(self):
+        MatrixFactorizationEngine().train()
+        processed, _ = BatchRecommendationEngine().run()
+        self.assertEqual(processed, 3)
+
+    def test_command(self):
+        call_command('update_recommendations', batch=True, stdout=io.StringIO())
+
+
+class RecommendationChangesTest(TestCase):
+    """
+    Запись пересчитанных списков рекомендаций
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.tracks = [
+            Track.objects.create(title=f'Track {idx}', artist=self.user, audio_file='tracks/track.mp3')
+            for idx in range(3)
+        ]
+        self.target = {
+            self.user.id: {track.id: (1.0 - idx / 10, 'popularity') for idx, track in enumerate(self.tracks)}
+        }
+
+    def test_unchanged_list_refreshes_updated_at(self):
+        _write_recommendation_changes(self.target)
+        stored = list(UserTrackRecommendation.objects.values_list('id', flat=True))
+
+        old = timezone.now() - timedelta(days=1)
+        UserTrackRecommendation.objects.update(updated_at=old)
+
+        _write_recommendation_changes(self.target)
+
+        self.assertEqual(sorted(UserTrackRecommendation.objects.values_list('id', flat=True)), sorted(stored))
+        self.assertFalse(UserTrackRecommendation.objects.filter(updated_at__lte=old).exists())
@@ -0,0 +1,49 @@
+# recommendations/versions.py
+
+import os
+import shutil
+import time
+
+
+def write_atomic(path, text):
+    """
+    Записать небольшой текстовый файл целиком: читатели видят либо старое, либо новое содержимое
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_path, path)
+
+
+def read_version(directory):
+    """
+    Актуальная версия данных в каталоге (None, если данные еще не записаны)
+    """
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as current:
+            return current.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def create_version(directory):
+    """
+    Создать каталог новой версии данных.
+    Возвращает номер версии и путь к ее каталогу
+    """
+    version = str(time.time_ns())
+    version_directory = os.path.join(directory, version)
+    os.makedirs(version_directory)
+    return version, version_directory
+
+
+def publish_version(directory, version):
+    """
+    Атомарно переключить файл CURRENT на записанную версию и удалить предыдущую.
+    Процессы, которые уже отобразили файлы старой версии в память, продолжают их читать
+    """
+    previous = read_version(directory)
+    write_atomic(os.path.join(directory, 'CURRENT'), version)
+
+    if previous and previous != version:
+        shutil.rmtree(os.path.join(directory, previous), ignore_errors=True)
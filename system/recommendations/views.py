@@ -1,3 +1,7 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -6,6 +10,8 @@ from rest_framework.views import APIView
 from .models import UserTrackRecommendation, UserPreference
 from .serializers import UserTrackRecommendationSerializer, UserPreferenceSerializer, RecommendationResponseSerializer
 from .algorithms import RecommendationEngine
+from .cache import recommendation_cache
+from .worker import enqueue_recommendation_refresh
 
 from tracks.models import Track, UserTrackInteraction, Genre
 from tracks.serializers import TrackSerializer
@@ -29,11 +35,22 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
         Получить персонализированные рекомендации для текущего пользователя
         """
         engine = RecommendationEngine()
-        recommendations = engine.get_recommendations_for_user(request.user.id, limit=20)
+        
+        if getattr(settings, 'RECOMMENDATION_SERVING_MODE', 'sync') == 'stale_while_revalidate':
+            # Сразу отдаем сохраненные рекомендации, а устаревшие пересчитываем в фоне
+            recommendations, updated_at = engine.get_stored_recommendations(request.user.id, limit=20)
+            
+            if not recommendations:
+                recommendations = engine.get_recommendations_for_user(request.user.id, limit=20)
+            else:
+                stale_after = timedelta(seconds=getattr(settings, 'RECOMMENDATION_STALE_AFTER', 3600))
+                if updated_at < timezone.now() - stale_after:
+                    enqueue_recommendation_refresh(request.user.id, limit=20)
+        else:
+            recommendations = engine.get_recommendations_for_user(request.user.id, limit=20)
         
         # Отмечаем рекомендации как показанные
-        for rec in recommendations:
-            engine.mark_recommendation_as_shown(request.user.id, rec['track'].id)
+        engine.mark_shown(request.user.id, [rec['track'].id for rec in recommendations])
         
         # Получаем только треки для сериализации
         tracks = [rec['track'] for rec in recommendations]
@@ -41,6 +58,13 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = TrackSerializer(tracks, many=True, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """
+        Получить статистику попаданий и промахов кэша рекомендаций
+        """
+        return Response(recommendation_cache.stats())
+    
     @action(detail=False, methods=['get'])
     def by_type(self, request):
         """
@@ -65,7 +89,7 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
         # Если рекомендаций нет, инициируем их создание
         if not collaborative_recs and not content_based_recs and not popularity_recs:
             engine = RecommendationEngine()
-            engine.get_recommendations_for_user(request.user.id, limit=30)
+            engine.get_recommendations_for_user(request.user.id, limit=30, use_cache=False)
             
             # Повторно получаем рекомендации
             collaborative_recs = UserTrackRecommendation.objects.filter(
@@ -85,12 +109,11 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
         
         # Отмечаем рекомендации как показанные
         engine = RecommendationEngine()
-        for rec in collaborative_recs:
-            engine.mark_recommendation_as_shown(request.user.id, rec.track.id)
-        for rec in content_based_recs:
-            engine.mark_recommendation_as_shown(request.user.id, rec.track.id)
-        for rec in popularity_recs:
-            engine.mark_recommendation_as_shown(request.user.id, rec.track.id)
+        engine.mark_shown(request.user.id, [
+            rec.track_id
+            for recs in (collaborative_recs, content_based_recs, popularity_recs)
+            for rec in recs
+        ])
         
         # Сериализуем рекомендации
         collaborative_serializer = TrackSerializer([rec.track for rec in collaborative_recs], many=True, context={'request': request})
@@ -118,20 +141,12 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
         ).values_list('track_id', flat=True).distinct()
         
         # Получаем треки, похожие на те, которые пользователь слушал
-        from .models import TrackSimilarity
-        from django.db.models import Q
+        from .similarity_storage import get_similar_track_ids
         
         similar_track_ids = set()
         for track_id in user_track_ids:
             # Находим похожие треки (как по коллаборативной, так и по контентной фильтрации)
-            similar_tracks = TrackSimilarity.objects.filter(
-                Q(track_a_id=track_id) | Q(track_b_id=track_id)
-            ).order_by('-similarity_score')[:5]
-            
-            for st in similar_tracks:
-                # Определяем ID похожего трека
-                similar_id = st.track_b_id if st.track_a_id == track_id else st.track_a_id
-                
+            for similar_id in get_similar_track_ids(track_id, limit=5):
                 # Добавляем в множество, если пользователь еще не слушал этот трек
                 if similar_id not in user_track_ids:
                     similar_track_ids.add(similar_id)
@@ -145,8 +160,7 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
         
         # Отмечаем рекомендации как показанные
         engine = RecommendationEngine()
-        for track in similar_tracks:
-            engine.mark_recommendation_as_shown(request.user.id, track.id)
+        engine.mark_shown(request.user.id, similar_track_ids)
         
         serializer = TrackSerializer(similar_tracks, many=True, context={'request': request})
         return Response(serializer.data)
@@ -182,8 +196,7 @@ class RecommendationViewSet(viewsets.ReadOnlyModelViewSet):
             
             # Отмечаем рекомендации как показанные
             engine = RecommendationEngine()
-            for track in genre_tracks:
-                engine.mark_recommendation_as_shown(request.user.id, track.id)
+            engine.mark_shown(request.user.id, [track.id for track in genre_tracks])
             
             serializer = TrackSerializer(genre_tracks, many=True, context={'request': request})
             return Response(serializer.data)
@@ -324,7 +337,7 @@ class RefreshRecommendationsView(APIView):
     
     def post(self, request):
         engine = RecommendationEngine()
-        recommendations = engine.get_recommendations_for_user(request.user.id, limit=30)
+        recommendations = engine.get_recommendations_for_user(request.user.id, limit=30, use_cache=False)
         
         if recommendations:
             return Response({
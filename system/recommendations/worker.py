@@ -0,0 +1,177 @@
+# recommendations/worker.py
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending_users = set()
+
+
+def _init_worker(settings_module):
+    """
+    Инициализация фонового процесса: настраиваем Django в новом интерпретаторе
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+
+def refresh_user_recommendations(user_id, limit):
+    """
+    Пересчитать и сохранить рекомендации пользователя (выполняется в фоновом процессе)
+    """
+    from .algorithms import RecommendationEngine
+    from .matrices import interaction_snapshot
+
+    engine = RecommendationEngine()
+    engine.get_recommendations_for_user(user_id, limit=limit, use_cache=False)
+
+    # Снимок матрицы взаимодействий записывается фоновым процессом, а не веб-процессом
+    interaction_snapshot.persist()
+    return user_id
+
+
+def run_batch_shard(data_dir, first_user_id, last_user_id, limit, chunk_size):
+    """
+    Рассчитать рекомендации для пользователей с ID от first_user_id до last_user_id
+    включительно (выполняется в фоновом процессе).
+
+    Данные для расчета читаются из файлов в data_dir, отображенных в память,
+    поэтому все процессы используют одну копию данных.
+    Возвращает количество обработанных пользователей и затраченное время
+    """
+    from users.models import User
+    from .algorithms import BatchRecommendationEngine
+
+    engine = BatchRecommendationEngine(limit=limit, chunk_size=chunk_size)
+    engine.load_shared(data_dir)
+
+    user_ids = User.objects.filter(
+        id__gte=first_user_id,
+        id__lte=last_user_id
+    ).order_by('id').values_list('id', flat=True)
+
+    return engine.run(user_ids)
+
+
+def create_process_pool(max_workers):
+    """
+    Создать пул процессов с настроенным Django.
+    Используем spawn, чтобы процессы не унаследовали соединения с базой
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'music_recommender.settings'),),
+    )
+
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = create_process_pool(getattr(settings, 'RECOMMENDATION_REFRESH_WORKERS', 1))
+        return _executor
+
+
+def _discard_executor(executor):
+    """
+    Отказаться от пула (например, после аварийного завершения процесса):
+    следующая задача создаст новый пул
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(user_id, limit):
+    """
+    Отправить пересчет в пул; сломанный пул один раз пересоздается.
+    Возвращает пул и задачу
+    """
+    executor = _get_executor()
+    try:
+        return executor, executor.submit(refresh_user_recommendations, user_id, limit)
+    except (BrokenProcessPool, RuntimeError):
+        _discard_executor(executor)
+
+    executor = _get_executor()
+    return executor, executor.submit(refresh_user_recommendations, user_id, limit)
+
+
+def _refresh_key(user_id):
+    return f'recommendations:refresh:{user_id}'
+
+
+def _on_refresh_done(user_id, executor):
+    def callback(future):
+        with _executor_lock:
+            _pending_users.discard(user_id)
+
+        if future.cancelled():
+            cache.delete(_refresh_key(user_id))
+            return
+
+        error = future.exception()
+        if error is not None:
+            # Неудачный пересчет можно повторить со следующим запросом
+            cache.delete(_refresh_key(user_id))
+            logger.error(
+                'Фоновый пересчет рекомендаций пользователя %s завершился ошибкой',
+                user_id, exc_info=error
+            )
+            if isinstance(error, BrokenProcessPool):
+                _discard_executor(executor)
+    return callback
+
+
+def enqueue_recommendation_refresh(user_id, limit=20):
+    """
+    Поставить пересчет рекомендаций пользователя в очередь фонового процесса.
+
+    Повторные запросы для одного пользователя не ставятся в очередь, пока не
+    пройдет RECOMMENDATION_STALE_AFTER секунд. Между процессами повторы
+    отсекаются только с общим для процессов бэкендом кэша (CACHES); с локальным
+    кэшем процесса (LocMemCache) каждый веб-процесс ставит свою задачу.
+    Ошибки постановки в очередь только записываются в лог, чтобы не мешать
+    отдаче сохраненных рекомендаций.
+    Возвращает True, если задача поставлена в очередь
+    """
+    with _executor_lock:
+        if user_id in _pending_users:
+            return False
+
+    # Не даем другим процессам поставить ту же задачу
+    timeout = getattr(settings, 'RECOMMENDATION_STALE_AFTER', 3600)
+    if not cache.add(_refresh_key(user_id), True, timeout):
+        return False
+
+    try:
+        executor, future = _submit(user_id, limit)
+    except Exception:
+        cache.delete(_refresh_key(user_id))
+        logger.exception('Не удалось поставить в очередь пересчет рекомендаций пользователя %s', user_id)
+        return False
+
+    with _executor_lock:
+        _pending_users.add(user_id)
+    future.add_done_callback(_on_refresh_done(user_id, executor))
+
+    return True
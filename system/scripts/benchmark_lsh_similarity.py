@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from scipy import sparse
+import django
+
+# Настройка Django
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'music_recommender.settings')
+django.setup()
+
+from django.test import override_settings
+
+from recommendations.algorithms import _approximate_cosine_similarity_pairs, _cosine_similarity_pairs
+
+
+def generate_matrix(n_users, n_items, interactions, communities, seed=42):
+    """
+    Случайная матрица пользователи x треки с сообществами: каждое сообщество
+    слушает в основном свою часть каталога, остальные прослушивания случайны.
+    Веса 1 (прослушивание) и 2 (лайк)
+    """
+    rng = np.random.default_rng(seed)
+    community = rng.integers(0, communities, size=n_users)
+    items_per_community = max(1, n_items // communities)
+
+    rows = np.repeat(np.arange(n_users), interactions)
+    own = rng.random(len(rows)) < 0.8
+    columns = np.where(
+        own,
+        community[rows] * items_per_community + rng.integers(0, items_per_community, size=len(rows)),
+        rng.integers(0, n_items, size=len(rows))
+    ) % n_items
+    weights = rng.choice([1.0, 2.0], size=len(rows))
+
+    matrix = sparse.csr_matrix((weights, (rows, columns)), shape=(n_users, n_items))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def collect(pairs):
+    """
+    Собрать пары генератора в словарь (строка, столбец) -> сходство
+    """
+    result = {}
+    for rows, columns, scores in pairs:
+        result.update(zip(zip(rows.tolist(), columns.tolist()), scores.tolist()))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Полнота и время приближенного (LSH) расчета сходства пользователей по сравнению с точным'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 10000, 30000],
+                        help='Количество пользователей')
+    parser.add_argument('--items', type=int, default=20000,
+                        help='Количество треков')
+    parser.add_argument('--interactions', type=int, default=30,
+                        help='Количество взаимодействий у каждого пользователя')
+    parser.add_argument('--communities', type=int, default=200,
+                        help='Количество сообществ пользователей со схожими вкусами')
+    parser.add_argument('--neighbours', type=int, default=50,
+                        help='Количество сохраняемых соседей пользователя')
+    parser.add_argument('--bands', type=int, nargs='+', default=[10, 20, 40],
+                        help='Количество полос сигнатуры')
+    parser.add_argument('--rows-per-band', type=int, nargs='+', default=[8, 6, 4],
+                        help='Количество бит в полосе')
+    parser.add_argument('--strong', type=float, default=0.3,
+                        help='Порог сходства для полноты по сильно похожим парам')
+    args = parser.parse_args()
+
+    print(f"{'Пользователей':>14} {'Полос':>6} {'Бит':>4} {'Точно, с':>10} {'LSH, с':>10} {'Ускорение':>10} {'Полнота':>8} {'Полнота (сильные)':>18}")
+
+    for size in args.sizes:
+        matrix = generate_matrix(size, args.items, args.interactions, args.communities)
+
+        start_time = time.time()
+        exact = collect(_cosine_similarity_pairs(matrix, args.neighbours))
+        exact_time = time.time() - start_time
+        strong = {pair for pair, score in exact.items() if score >= args.strong}
+
+        for bands in args.bands:
+            for rows_per_band in args.rows_per_band:
+                with override_settings(RECOMMENDATION_LSH_BANDS=bands, RECOMMENDATION_LSH_ROWS_PER_BAND=rows_per_band):
+                    start_time = time.time()
+                    approximate = collect(_approximate_cosine_similarity_pairs(matrix, args.neighbours))
+                    lsh_time = time.time() - start_time
+
+                # Доля точных K ближайших соседей, найденных приближенным расчетом
+                recall = len(exact.keys() & approximate.keys()) / len(exact) if exact else 1.0
+                strong_recall = len(strong & approximate.keys()) / len(strong) if strong else 1.0
+                speedup = exact_time / lsh_time if lsh_time > 0 else float('inf')
+                print(f"{size:>14} {bands:>6} {rows_per_band:>4} {exact_time:>10.2f} {lsh_time:>10.2f} {speedup:>9.1f}x {recall:>8.3f} {strong_recall:>18.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+import django
+
+# Настройка Django
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'music_recommender.settings')
+django.setup()
+
+from recommendations.algorithms import _cosine_similarity_pairs
+from recommendations.models import UserSimilarity
+
+
+def generate_matrix(n_entities, n_items, interactions, seed=42):
+    """
+    Случайная разреженная матрица объекты x элементы с весами 1 (прослушивание) и 2 (лайк)
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.repeat(np.arange(n_entities), interactions)
+    columns = rng.integers(0, n_items, size=len(rows))
+    weights = rng.choice([1.0, 2.0], size=len(rows))
+    matrix = sparse.csr_matrix((weights, (rows, columns)), shape=(n_entities, n_items))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def benchmark_loop(matrix, ids, loop_rows):
+    """
+    Прежний способ: плотная матрица сходства в DataFrame, перебор пар через .loc
+    и создание объекта модели для каждой положительной пары.
+
+    Для ускорения замера обрабатываются только первые loop_rows строк,
+    время для всей матрицы оценивается пропорционально
+    """
+    start_time = time.time()
+
+    rows = min(loop_rows, matrix.shape[0])
+    similarity = cosine_similarity(matrix[:rows], matrix)
+    similarity_df = pd.DataFrame(similarity, index=ids[:rows], columns=ids)
+
+    records = 0
+    for user_a in similarity_df.index:
+        for user_b in similarity_df.columns:
+            if user_a != user_b:
+                value = similarity_df.loc[user_a, user_b]
+                if value > 0:
+                    UserSimilarity(user_a_id=user_a, user_b_id=user_b, similarity_score=value)
+                    records += 1
+
+    elapsed = time.time() - start_time
+    scale = matrix.shape[0] / rows
+    return elapsed * scale, rows < matrix.shape[0]
+
+
+def benchmark_vectorized(matrix, ids):
+    """
+    Новый способ: блочный расчет сходства, выбор пар через np.nonzero и
+    подготовка строк для executemany без создания объектов модели
+    """
+    start_time = time.time()
+
+    pairs = 0
+    for rows, columns, scores in _cosine_similarity_pairs(matrix):
+        batch = list(zip(ids[rows].tolist(), ids[columns].tolist(), scores.tolist()))
+        pairs += len(batch)
+
+    return time.time() - start_time, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Сравнение времени выбора пар сходства: перебор через .loc и векторный способ'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000],
+                        help='Количество объектов (пользователей или треков)')
+    parser.add_argument('--items', type=int, default=10000,
+                        help='Количество элементов (столбцов матрицы)')
+    parser.add_argument('--interactions', type=int, default=20,
+                        help='Количество взаимодействий у каждого объекта')
+    parser.add_argument('--loop-rows', type=int, default=200,
+                        help='Количество строк, на которых замеряется перебор через .loc')
+    args = parser.parse_args()
+
+    print(f"{'Объектов':>10} {'Пар':>12} {'Векторно, с':>14} {'Перебор .loc, с':>18} {'Ускорение':>10}")
+
+    for size in args.sizes:
+        matrix = generate_matrix(size, args.items, args.interactions)
+        ids = np.arange(1, size + 1, dtype=np.int64)
+
+        vectorized_time, pairs = benchmark_vectorized(matrix, ids)
+        loop_time, estimated = benchmark_loop(matrix, ids, args.loop_rows)
+
+        loop_label = f"{'~' if estimated else ''}{loop_time:.2f}"
+        speedup = loop_time / vectorized_time if vectorized_time > 0 else float('inf')
+        print(f"{size:>10} {pairs:>12} {vectorized_time:>14.2f} {loop_label:>18} {speedup:>9.0f}x")
+
+    print("~ - оценка по первым строкам матрицы (см. --loop-rows)")
+
+
+if __name__ == '__main__':
+    main()